@@ -6,10 +6,10 @@ from uuid import uuid4
 from flask import Blueprint, request
 from src.auth.oauth2 import get_user_for_token
 
+from . import commands
+from .catalog import CATALOG
 from .discovery import Device, DeviceDiscovery
-from .frame_constants import DataKeys
-from .frames import (DEFAULT_ENCODER, CommandFrame, FrameData, FrameEncoder,
-                     FrameType, Header, MotoCmd)
+from .frames import DEFAULT_ENCODER, FrameEncoder, MotoCmd
 from .gizapi import GizApi, GizToken
 
 
@@ -27,7 +27,7 @@ class Capabilities:
                 'name': supported
             }],
             'proactivelyReported': True,
-            'retrievable': False
+            'retrievable': True
         }
     }
 
@@ -60,6 +60,8 @@ class Alexa:
       return self._handle_on_off(directive, 'OFF')
     elif method == 'Alexa.PercentageController.SetPercentage':
       return self._handle_pct(directive)
+    elif method == 'Alexa.ReportState':
+      return self._handle_report_state(directive)
 
   @staticmethod
   def _giz_token_from_bearer(token: str):
@@ -70,27 +72,22 @@ class Alexa:
   def _handle_discovery(self, directive):
     bearer_token = directive['payload']['scope']['token']
     giz_token = self._giz_token_from_bearer(bearer_token)
-    discovery = DeviceDiscovery(self._api, giz_token)
-    devices = discovery.discover()
-    return json.dumps({
-        'event': {
-            'header': {
-                'namespace': 'Alexa.Discovery',
-                'name': 'Discover.Response',
-                'payloadVersion': '3',
-                'messageId': str(uuid4())
-            },
-            'payload': {
-                'endpoints': [self._make_endpoint(ep) for ep in devices]
-            }
-        }
+    catalog = CATALOG.get(self._api, giz_token)
+    endpoints = CATALOG.endpoints(catalog, 'alexa', self._make_endpoint)
+    header = json.dumps({
+        'namespace': 'Alexa.Discovery',
+        'name': 'Discover.Response',
+        'payloadVersion': '3',
+        'messageId': str(uuid4())
     })
+    return '{"event": {"header": %s, "payload": {"endpoints": %s}}}' % (
+        header, endpoints)
 
   @staticmethod
   def _make_endpoint(device: Device):
     return {
         "endpointId":
-            "%s#%s" % (device.did, device.channel.hex()),
+            device.id,
         "manufacturerName":
             "Shade Store",
         "description":
@@ -115,15 +112,15 @@ class Alexa:
     did = req['endpoint']['cookie']['did']
     channel_hex = req['endpoint']['cookie']['channelHex']
     cmd = MotoCmd.UP if state == 'OFF' else MotoCmd.DOWN
-    frame = CommandFrame(
-        header=Header(0, 144, 5),
-        frame_type=FrameType.DEVICE_EXECUTE_REQ,
-        data=[
-            FrameData(DataKeys.DEVICE_CMD.value, cmd.value),
-            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value,
-                      bytes.fromhex(channel_hex))
-        ])
-    self._api.control(giz_token, did, frame)
+    frame = commands.moto_cmd(bytes.fromhex(channel_hex), cmd)
+    resp = self._api.control_latest(giz_token, did,
+                                    req['endpoint']['endpointId'], frame)
+    if 'error_message' in resp:
+      return self._make_error_response(
+          bearer_token=bearer_token,
+          message=resp['error_message'],
+          correlation_token=req['header']['correlationToken'],
+          endpoint_id=req['endpoint']['endpointId'])
     return self._make_response(
         bearer_token=bearer_token,
         namespace='Alexa.PowerController',
@@ -181,23 +178,46 @@ class Alexa:
     })
     return ret
 
+  def _make_error_response(self, bearer_token, message, correlation_token,
+                           endpoint_id):
+    return json.dumps({
+        "event": {
+            "header": {
+                "namespace": "Alexa",
+                "name": "ErrorResponse",
+                "payloadVersion": "3",
+                "messageId": str(uuid4()),
+                "correlationToken": correlation_token
+            },
+            "endpoint": {
+                "scope": {
+                    "type": "BearerToken",
+                    "token": bearer_token
+                },
+                "endpointId": endpoint_id
+            },
+            "payload": {
+                "type": "ENDPOINT_UNREACHABLE",
+                "message": message
+            }
+        }
+    })
+
   def _handle_pct(self, req):
     bearer_token = req['endpoint']['scope']['token']
     giz_token = self._giz_token_from_bearer(bearer_token)
     did = req['endpoint']['cookie']['did']
     channel_hex = req['endpoint']['cookie']['channelHex']
     pct = req['payload']['percentage']
-    frame = CommandFrame(
-        header=Header(0, 144, 5),
-        frame_type=FrameType.DEVICE_EXECUTE_REQ,
-        data=[
-            FrameData(DataKeys.DEVICE_CMD.value,
-                      MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value),
-            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value,
-                      bytes.fromhex(channel_hex)),
-            FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, pct, 0]))
-        ])
-    self._api.control(giz_token, did, frame)
+    frame = commands.set_closed_pct(bytes.fromhex(channel_hex), pct)
+    resp = self._api.control_latest(giz_token, did,
+                                    req['endpoint']['endpointId'], frame)
+    if 'error_message' in resp:
+      return self._make_error_response(
+          bearer_token=bearer_token,
+          message=resp['error_message'],
+          correlation_token=req['header']['correlationToken'],
+          endpoint_id=req['endpoint']['endpointId'])
     return self._make_response(
         bearer_token=bearer_token,
         namespace='Alexa.PercentageController',
@@ -205,3 +225,65 @@ class Alexa:
         value=pct,
         correlation_token=req['header']['correlationToken'],
         endpoint_id=req['endpoint']['endpointId'])
+
+  def _handle_report_state(self, req):
+    bearer_token = req['endpoint']['scope']['token']
+    giz_token = self._giz_token_from_bearer(bearer_token)
+    cookie = req['endpoint']['cookie']
+    device = Device(cookie['did'], bytes.fromhex(cookie['channelHex']), None,
+                    None)
+    discovery = DeviceDiscovery(self._api, giz_token)
+    result = discovery.query_positions([device])
+    closed_pct = result.positions.get(device.id)
+    if closed_pct is None:
+      return self._make_error_response(
+          bearer_token=bearer_token,
+          message=result.errors.get(device.id, ''),
+          correlation_token=req['header']['correlationToken'],
+          endpoint_id=req['endpoint']['endpointId'])
+
+    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    header = {
+        "namespace": "Alexa",
+        "name": "StateReport",
+        "messageId": str(uuid4()),
+        "correlationToken": req['header']['correlationToken'],
+        "payloadVersion": "3"
+    }
+    endpoint = {
+        "scope": {
+            "type": "BearerToken",
+            "token": bearer_token
+        },
+        "endpointId": req['endpoint']['endpointId']
+    }
+    return json.dumps({
+        "context": {
+            "properties": [{
+                "namespace": "Alexa.PercentageController",
+                "name": "percentage",
+                "value": closed_pct,
+                "timeOfSample": now,
+                "uncertaintyInMilliseconds": 0
+            }, {
+                "namespace": "Alexa.PowerController",
+                "name": "powerState",
+                "value": "ON" if closed_pct else "OFF",
+                "timeOfSample": now,
+                "uncertaintyInMilliseconds": 0
+            }, {
+                "namespace": "Alexa.EndpointHealth",
+                "name": "connectivity",
+                "value": {
+                    "value": "OK"
+                },
+                "timeOfSample": now,
+                "uncertaintyInMilliseconds": 0
+            }]
+        },
+        "event": {
+            "header": header,
+            "endpoint": endpoint,
+            "payload": {}
+        }
+    })
@@ -1,14 +1,20 @@
 import dataclasses
+import json
 import time
 
 from google.cloud.datastore import Client, Entity
 
+from ..cache import LRUCache
 from ..config import CONFIG
 from . import crypto
-from .models import (OAuth2AuthorizationCode, OAuth2RefreshToken, OAuth2Token,
-                     Session, User)
+from .models import (DeviceCatalog, OAuth2AuthorizationCode, OAuth2RefreshToken,
+                     OAuth2Token, Session, User)
 
 _CLIENT = None
+# how long a key that wasn't found in Datastore is remembered as missing;
+# writes to the key forget it right away
+_NEGATIVE_CACHE_SIZE = CONFIG.get('negative_cache_size', 10000)
+_NEGATIVE_CACHE_TTL = CONFIG.get('negative_cache_ttl', 30)
 
 
 def CLIENT():
@@ -20,6 +26,7 @@ def CLIENT():
 
 class AuthCodeRepo:
   KIND = 'AuthCode'
+  _MISSING = LRUCache(_NEGATIVE_CACHE_SIZE, ttl=_NEGATIVE_CACHE_TTL)
 
   @classmethod
   def put_auth_code(cls, code):
@@ -27,22 +34,35 @@ class AuthCodeRepo:
     ent = Entity(code_key)
     ent.update(dataclasses.asdict(code))
     CLIENT().put(ent)
+    cls._MISSING.pop(code.code)
 
   @classmethod
   def get_auth_code(cls, code):
+    if code in cls._MISSING:
+      return None
     code_key = CLIENT().key(cls.KIND, code)
     ent = CLIENT().get(code_key)
-    return OAuth2AuthorizationCode(**ent) if ent else None
+    if not ent:
+      cls._MISSING.put(code, True)
+      return None
+    return OAuth2AuthorizationCode(**ent)
 
   @classmethod
   def del_auth_code(cls, code):
     code_key = CLIENT().key(cls.KIND, code)
     CLIENT().delete(code_key)
+    cls._MISSING.put(code, True)
 
 
 class TokenRepo:
   KIND = 'GrantToken'
   REFRESH_KIND = 'RefreshToken'
+  # access tokens never change, so they're kept until they expire
+  _CACHE = LRUCache(
+      CONFIG.get('token_cache_size', 10000),
+      ttl=CONFIG.get('token_cache_ttl', 3600))
+  # access and refresh tokens that weren't found, keyed by (kind, token)
+  _MISSING = LRUCache(_NEGATIVE_CACHE_SIZE, ttl=_NEGATIVE_CACHE_TTL)
 
   @classmethod
   def put_token(cls, token, request):
@@ -56,6 +76,7 @@ class TokenRepo:
     ent = Entity(key)
     ent.update(dataclasses.asdict(token_obj))
     CLIENT().put(ent)
+    cls._MISSING.pop((cls.KIND, token_obj.access_token))
 
     refresh_token = token['refresh_token']
     refresh_obj = OAuth2RefreshToken(refresh_token, token_obj.access_token)
@@ -63,25 +84,54 @@ class TokenRepo:
     ent = Entity(key)
     ent.update(dataclasses.asdict(refresh_obj))
     CLIENT().put(ent)
+    cls._MISSING.pop((cls.REFRESH_KIND, refresh_token))
 
   @classmethod
   def get_token(cls, token_string):
+    token = cls._CACHE.get(token_string)
+    if token is not None:
+      return token
+    if (cls.KIND, token_string) in cls._MISSING:
+      return None
     key = CLIENT().key(cls.KIND, token_string)
     ent = CLIENT().get(key)
-    return OAuth2Token(**ent) if ent else None
+    if not ent:
+      cls._MISSING.put((cls.KIND, token_string), True)
+      return None
+    token = OAuth2Token(**ent)
+    ttl = token.expires_at - time.time()
+    if cls._CACHE.ttl is not None:
+      ttl = min(ttl, cls._CACHE.ttl)
+    if ttl > 0:
+      cls._CACHE.put(token_string, token, ttl=ttl)
+    return token
+
+  @classmethod
+  def cache_metrics(cls):
+    return {
+        'hits': cls._CACHE.hits,
+        'misses': cls._CACHE.misses,
+        'negative_hits': cls._MISSING.hits,
+        'negative_evictions': cls._MISSING.evictions
+    }
 
   @classmethod
   def get_token_by_refresh_token(cls, refresh_token):
+    if (cls.REFRESH_KIND, refresh_token) in cls._MISSING:
+      return None
     key = CLIENT().key(cls.REFRESH_KIND, refresh_token)
     ent = CLIENT().get(key)
     if ent is None:
+      cls._MISSING.put((cls.REFRESH_KIND, refresh_token), True)
       return None
     return cls.get_token(ent['access_token'])
 
   @classmethod
   def del_token(cls, token):
+    cls._CACHE.pop(token)
     key = CLIENT().key(cls.KIND, token)
     CLIENT().delete(key)
+    cls._MISSING.put((cls.KIND, token), True)
 
 
 class UserRepo:
@@ -120,3 +170,30 @@ class SessionRepo:
   def get_session(cls, session_id):
     decrypted_user_bytes = crypto.SESSION.decrypt(session_id.encode('utf-8'))
     return Session(session_id, decrypted_user_bytes.decode('utf-8'), 0)
+
+
+class CatalogRepo:
+  KIND = 'DeviceCatalog'
+
+  @classmethod
+  def get_catalog(cls, username) -> DeviceCatalog:
+    key = CLIENT().key(cls.KIND, username)
+    ent = CLIENT().get(key)
+    if not ent:
+      return None
+    ent['endpoints'] = json.loads(ent['endpoints'])
+    return DeviceCatalog(**ent)
+
+  @classmethod
+  def put_catalog(cls, catalog):
+    key = CLIENT().key(cls.KIND, catalog.username)
+    # the JSON blobs are past the size limit for indexed properties
+    ent = Entity(key, exclude_from_indexes=('devices', 'endpoints'))
+    ent.update(dataclasses.asdict(catalog))
+    ent['endpoints'] = json.dumps(catalog.endpoints)
+    CLIENT().put(ent)
+
+  @classmethod
+  def del_catalog(cls, username):
+    key = CLIENT().key(cls.KIND, username)
+    CLIENT().delete(key)
@@ -1,6 +1,6 @@
 import time
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, List
 
 from authlib.oauth2.rfc6749.models import ClientMixin, TokenMixin
 
@@ -114,3 +114,13 @@ class OAuth2Token(TokenMixin):
 class OAuth2RefreshToken:
   refresh_token: str
   access_token: str
+
+
+@dataclass
+class DeviceCatalog:
+  username: str
+  # JSON list of [did, channel hex, name]
+  devices: str
+  refreshed_at: int
+  # JSON endpoint lists already rendered for each frontend
+  endpoints: Dict[str, str] = field(default_factory=dict)
@@ -8,6 +8,7 @@ from flask import (Blueprint, make_response, redirect, render_template, request,
                    session)
 from werkzeug.security import gen_salt
 
+from ..catalog import CATALOG
 from ..config import CONFIG
 from ..gizapi import GizApi, GizAuthError, GizToken
 from .datastore import AuthCodeRepo, TokenRepo, UserRepo
@@ -136,6 +137,8 @@ class OAuth:
       return render_template('login.html', errormessage=e)
 
     UserRepo.put_user(user)
+    # the account may have been relinked to another Gizwits login
+    CATALOG.invalidate(username)
     session['username'] = username
     resp = redirect(dst) if dst else make_response()
     return resp
@@ -29,6 +29,12 @@ class BinaryReader:
     self._pos += 4
     return ret[0]
 
+  def tell(self):
+    return self._pos
+
+  def skip(self, num):
+    self._pos += num
+
   def get_bytes(self, num):
     ret = self._d[self._pos:self._pos + num]
     self._pos += num
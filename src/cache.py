@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+  """A thread safe dict holding at most max_size entries.
+
+  The least recently used entry is dropped to make room for a new one.
+  Entries expire ttl seconds after they were put, unless put overrides the
+  ttl for that entry; ttl=None keeps entries until they are evicted.
+  """
+
+  def __init__(self, max_size: int, ttl: float = None, clock=time.monotonic):
+    self._max_size = max_size
+    self._ttl = ttl
+    self._clock = clock
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @property
+  def ttl(self):
+    return self._ttl
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return self.get(key, _MISSING) is not _MISSING
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        value, expires_at = entry
+        if expires_at is None or expires_at > self._clock():
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return value
+        del self._entries[key]
+      self.misses += 1
+      return default
+
+  def put(self, key, value, ttl: float = _MISSING):
+    if ttl is _MISSING:
+      ttl = self._ttl
+    expires_at = None if ttl is None else self._clock() + ttl
+    with self._lock:
+      self._entries[key] = (value, expires_at)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self._max_size:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def items(self):
+    """Returns a snapshot of the live entries, least recently used first."""
+    now = self._clock()
+    with self._lock:
+      return [(key, value)
+              for key, (value, expires_at) in self._entries.items()
+              if expires_at is None or expires_at > now]
+
+  def pop(self, key, default=None):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+    return default if entry is None else entry[0]
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from .auth.datastore import CatalogRepo
+from .auth.models import DeviceCatalog
+from .cache import LRUCache
+from .config import CONFIG
+from .discovery import Device, DeviceDiscovery, IncompleteDiscoveryError
+from .gizapi import GizApi, GizToken
+from .js import JSON
+
+LOG = logging.getLogger('catalog')
+
+# rendered endpoints are only reused by the deploy that rendered them, whose
+# _make_endpoint / _make_device made them
+_RENDER_VERSION = os.environ.get('GAE_VERSION', '')
+
+
+def catalog_devices(catalog: DeviceCatalog) -> List[Device]:
+  return [
+      Device(did, bytes.fromhex(channel_hex), name, None)
+      for did, channel_hex, name in JSON.loads(catalog.devices)
+  ]
+
+
+class CatalogCache:
+  """The devices of each user, as last discovered.
+
+  Catalogs are kept in Datastore next to the user, and for memory_ttl
+  seconds in memory, so other instances see an invalidation soon.  A catalog
+  older than refresh_after seconds is still served while a background thread
+  discovers it again; one older than ttl seconds is rediscovered before it's
+  served.
+  """
+
+  def __init__(self,
+               ttl: int = CONFIG.get('catalog_ttl', 7 * 86400),
+               refresh_after: int = CONFIG.get('catalog_refresh_after', 86400),
+               max_size: int = CONFIG.get('catalog_cache_size', 1000),
+               memory_ttl: float = CONFIG.get('catalog_memory_ttl', 60)):
+    self._ttl = ttl
+    self._refresh_after = refresh_after
+    self._catalogs = LRUCache(max_size, ttl=memory_ttl)
+    self._refreshing = set()
+    self._lock = threading.Lock()
+    self._executor = ThreadPoolExecutor(
+        max_workers=CONFIG.get('catalog_refresh_threads', 2))
+
+  def get(self, api: GizApi, token: GizToken) -> DeviceCatalog:
+    catalog = self._catalogs.get(token.username)
+    if catalog is None:
+      catalog = CatalogRepo.get_catalog(token.username)
+      if catalog is not None:
+        self._catalogs.put(token.username, catalog)
+    if catalog is not None:
+      age = time.time() - catalog.refreshed_at
+      if age < self._ttl:
+        if age >= self._refresh_after:
+          self._refresh_later(api, token)
+        return catalog
+    try:
+      return self.refresh(api, token)
+    except Exception:
+      if catalog is None:
+        raise
+      LOG.exception(
+          'refreshing the catalog of %s failed, serving the stored one',
+          token.username)
+      return catalog
+
+  def refresh(self, api: GizApi, token: GizToken) -> DeviceCatalog:
+    try:
+      devices = DeviceDiscovery(api, token).discover()
+    except IncompleteDiscoveryError as e:
+      # a catalog missing a hub would make the frontends drop its devices, so
+      # those hubs keep the devices stored for them
+      stored = (
+          self._catalogs.get(token.username) or
+          CatalogRepo.get_catalog(token.username))
+      if stored is None:
+        raise
+      LOG.warning('%s, keeping their stored devices', e)
+      devices = e.devices + [
+          d for d in catalog_devices(stored) if d.did in e.missing
+      ]
+    catalog = DeviceCatalog(
+        username=token.username,
+        devices=JSON.dumps([[d.did, d.channel.hex(), d.name] for d in devices]),
+        refreshed_at=int(time.time()))
+    self._put(catalog)
+    return catalog
+
+  def _refresh_later(self, api: GizApi, token: GizToken):
+    with self._lock:
+      if token.username in self._refreshing:
+        return
+      self._refreshing.add(token.username)
+
+    def _refresh():
+      try:
+        self.refresh(api, token)
+      except Exception:
+        LOG.exception('refreshing the catalog of %s failed', token.username)
+      finally:
+        with self._lock:
+          self._refreshing.discard(token.username)
+
+    self._executor.submit(_refresh)
+
+  def endpoints(self, catalog: DeviceCatalog, frontend: str,
+                make_endpoint: Callable[[Device], dict]) -> str:
+    """Returns the JSON list of make_endpoint for each device in catalog.
+
+    The list is rendered once per catalog, frontend and deploy.
+    """
+    key = '%s@%s' % (frontend, _RENDER_VERSION)
+    rendered = catalog.endpoints.get(key)
+    if rendered is None:
+      devices = catalog_devices(catalog)
+      rendered = JSON.dumps([make_endpoint(d) for d in devices])
+      endpoints = {
+          k: v
+          for k, v in catalog.endpoints.items()
+          if k.split('@')[0] != frontend
+      }
+      endpoints[key] = rendered
+      catalog.endpoints = endpoints
+      self._put(catalog)
+    return rendered
+
+  def _put(self, catalog: DeviceCatalog):
+    self._catalogs.put(catalog.username, catalog)
+    CatalogRepo.put_catalog(catalog)
+
+  def invalidate(self, username: str):
+    self._catalogs.pop(username)
+    CatalogRepo.del_catalog(username)
+
+
+CATALOG = CatalogCache()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+from .config import CONFIG
+
+LOG = logging.getLogger('coalescer')
+
+
+class _Pending:
+
+  def __init__(self):
+    self.token = None
+    self.frame = None
+    self.waiters = []
+    self.task = None
+
+
+class CommandCoalescer:
+  """Sends only the latest of a burst of commands to each device.
+
+  A command for a device that is idle is sent right away.  Commands
+  arriving while one is being sent, or within window seconds after, wait
+  until then; each replaces the one waiting before it, and their callers
+  all get the result of the one that is sent.  Commands for a device are
+  sent one at a time, in order.
+  """
+
+  def __init__(self, api, window: float = CONFIG.get('coalesce_window', 0.2)):
+    self._api = api
+    self._window = window
+    self._pending = {}
+    self.submitted = 0
+    self.coalesced = 0
+    self.sent = 0
+
+  def metrics(self):
+    return {
+        'submitted': self.submitted,
+        'coalesced': self.coalesced,
+        'sent': self.sent
+    }
+
+  async def submit(self, giz_token, did: str, device_key: str, frame):
+    """Queues frame for did, replacing any unsent command for device_key."""
+    pending = self._pending.get(device_key)
+    if pending is None:
+      pending = self._pending[device_key] = _Pending()
+    self.submitted += 1
+    if pending.waiters:
+      self.coalesced += 1
+    pending.token = giz_token
+    pending.frame = frame
+    waiter = asyncio.get_event_loop().create_future()
+    pending.waiters.append(waiter)
+    if pending.task is None or pending.task.done():
+      pending.task = asyncio.ensure_future(
+          self._drain(did, device_key, pending))
+    return await asyncio.shield(waiter)
+
+  async def _drain(self, did: str, device_key: str, pending: _Pending):
+    waiters = []
+    try:
+      while pending.waiters:
+        waiters, pending.waiters = pending.waiters, []
+        if len(waiters) > 1:
+          LOG.info('sending 1 of %d commands for %s', len(waiters), device_key)
+        try:
+          resp = await self._api.control(pending.token, did, pending.frame)
+        except Exception as e:
+          for w in waiters:
+            if not w.done():
+              w.set_exception(e)
+        else:
+          for w in waiters:
+            if not w.done():
+              w.set_result(resp)
+        self.sent += 1
+        # the device stays busy for window, collecting what follows
+        await asyncio.sleep(self._window)
+    finally:
+      if self._pending.get(device_key) is pending:
+        del self._pending[device_key]
+      for w in waiters + pending.waiters:
+        if not w.done():
+          w.cancel()
@@ -0,0 +1,54 @@
+from typing import List, Tuple
+
+from .frame_constants import DataKeys
+from .frames import (BoundFrame, CommandFrame, FrameData, FrameTemplate,
+                     FrameType, Header, MotoCmd, Slot)
+
+EXECUTE_MOTO_CMD = FrameTemplate(
+    CommandFrame(
+        header=Header(0, 144, 5),
+        frame_type=FrameType.DEVICE_EXECUTE_REQ,
+        data=[
+            FrameData(DataKeys.DEVICE_CMD.value, Slot('cmd')),
+            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, Slot('channel'))
+        ]))
+
+EXECUTE_PERCENT = FrameTemplate(
+    CommandFrame(
+        header=Header(0, 144, 5),
+        frame_type=FrameType.DEVICE_EXECUTE_REQ,
+        data=[
+            FrameData(DataKeys.DEVICE_CMD.value,
+                      MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value),
+            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, Slot('channel')),
+            FrameData(DataKeys.DEVICE_CMD_DATA.value, Slot('cmd_data'))
+        ]))
+
+
+def moto_cmd(channel: bytes, cmd: MotoCmd) -> BoundFrame:
+  return EXECUTE_MOTO_CMD.bind(cmd=cmd.value, channel=channel)
+
+
+def set_closed_pct(channel: bytes, closed_pct: int) -> BoundFrame:
+  return EXECUTE_PERCENT.bind(
+      channel=channel, cmd_data=bytes([1, closed_pct, 0]))
+
+
+def set_closed_pcts(targets: List[Tuple[bytes, int]]) -> CommandFrame:
+  """Moves several channels behind one hub with a single frame.
+
+  targets are (channel, closed_pct) pairs; each becomes its own
+  DEVICE_ADDR_CHANNEL / DEVICE_CMD_DATA pair, as in device lists.
+  """
+  data = [
+      FrameData(DataKeys.DEVICE_CMD.value,
+                MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value)
+  ]
+  for channel, closed_pct in targets:
+    data.append(FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel))
+    data.append(
+        FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, closed_pct, 0])))
+  return CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_EXECUTE_REQ,
+      data=data)
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Union
+
+import websockets
+
+from .config import CONFIG
+from .frames import (DEFAULT_DECODER, DEFAULT_ENCODER, BoundFrame, CommandFrame,
+                     FrameDecoder, FrameEncoder, SequenceAllocators)
+from .gizapi import GizToken
+from .js import JSON
+
+LOG = logging.getLogger('connection')
+
+_DEFAULT_URL = 'wss://ussandbox.gizwits.com:8880/ws/app/v1'
+_CLOSED = object()
+
+CONNECT_TIMEOUT = CONFIG.get('connect_timeout', 10)
+
+
+class GizConnectionError(Exception):
+  pass
+
+
+class Subscription:
+  """Messages a connection received that no request was waiting for.
+
+  Items are (did, frame) for s2c_raw frames and (None, message) for any other
+  pushed message.  The queue is bounded; when a slow consumer lets it fill up
+  the oldest item is dropped.  Once the socket is lost, get raises the error
+  that ended it.
+  """
+
+  def __init__(self, conn: 'GizConnection', maxsize: int):
+    self._conn = conn
+    self._queue = asyncio.Queue(maxsize)
+    self._error = None
+    self.dropped = 0
+
+  def _put(self, item):
+    if self._queue.full():
+      self._queue.get_nowait()
+      self.dropped += 1
+    self._queue.put_nowait(item)
+
+  def _close(self, error: Exception):
+    self._error = error
+    self.close()
+    self._put(_CLOSED)
+
+  async def get(self):
+    item = await self._queue.get()
+    if item is _CLOSED:
+      self._queue.put_nowait(_CLOSED)
+      raise self._error
+    return item
+
+  def close(self):
+    self._conn._subscriptions.discard(self)
+
+
+class GizConnection:
+  """A Gizwits websocket logged in as one user.
+
+  A reader task owns the receive side of the socket.  Each s2c_raw reply is
+  handed to the request waiting on its (did, seq num, frame type), so any
+  number of requests can be in flight at once; everything else goes to the
+  subscriptions.  Reconnects and logs in again on demand, e.g. after the
+  server dropped the socket or the user's token was refreshed.
+  """
+
+  def __init__(self,
+               url: str,
+               appid: str,
+               heartbeat_interval: int,
+               enc: FrameEncoder = None,
+               dec: FrameDecoder = None):
+    self._url = url
+    self._appid = appid
+    self._heartbeat_interval = heartbeat_interval
+    self._enc = enc or DEFAULT_ENCODER
+    self._dec = dec or DEFAULT_DECODER
+    self._ws = None
+    self._reader = None
+    self._login_token = None
+    self._waiters = {}
+    self._subscriptions = set()
+    # replies reach every socket logged in as the user, so start where other
+    # connections are unlikely to be
+    self.seqs = SequenceAllocators(random.randrange(0x10000))
+    self.lock = asyncio.Lock()
+    self.active = 0
+    self.last_sent = 0
+    self.last_used = time.monotonic()
+
+  @property
+  def is_open(self):
+    return self._ws is not None and self._ws.open
+
+  @property
+  def in_flight(self):
+    return len(self._waiters)
+
+  def _login_msg(self, token: GizToken):
+    return JSON.dumps({
+        "cmd": "login_req",
+        "data": {
+            "appid": self._appid,
+            "uid": token.uid,
+            "token": token.token,
+            "p0_type": "custom",
+            "heartbeat_interval": self._heartbeat_interval,
+            "auto_subscribe": True
+        }
+    })
+
+  async def ensure(self, token: GizToken, timeout: float = CONNECT_TIMEOUT):
+    """Connects and logs in as token unless that's already the case.
+
+    Callers hold lock.
+    """
+    # without a heartbeat for heartbeat_interval the server has dropped us,
+    # even if the socket doesn't know it yet
+    if (self.is_open and
+        time.monotonic() - self.last_sent > self._heartbeat_interval):
+      await self.close()
+    if not self.is_open:
+      await self.close()
+      self._ws = await asyncio.wait_for(
+          websockets.connect(self._url, ssl=True), timeout)
+      self._waiters = {}
+      self._reader = asyncio.ensure_future(
+          self._read_loop(self._ws, self._waiters))
+    if self._login_token != token.token:
+      waiters = self._waiters
+      waiter = asyncio.get_event_loop().create_future()
+      waiters['login_res'] = waiter
+      try:
+        await self.send(self._login_msg(token))
+        resp = await asyncio.wait_for(waiter, timeout)
+      finally:
+        waiters.pop('login_res', None)
+      if not resp.get('data', {}).get('success', False):
+        await self.close()
+        raise GizConnectionError('login failed: %s' % resp)
+      self._login_token = token.token
+    self.last_used = time.monotonic()
+
+  async def send(self, msg: str):
+    if self._ws is None:
+      raise websockets.ConnectionClosed(1006, 'not connected')
+    await self._ws.send(msg)
+    self.last_sent = time.monotonic()
+
+  async def request(self,
+                    did: str,
+                    frame: Union[CommandFrame, BoundFrame],
+                    resp_type: int,
+                    timeout: float = None):
+    """Sends frame to did and returns the resp_type frame answering it."""
+    seq = self.seqs.next(did)
+    key = (did, seq, resp_type)
+    waiters = self._waiters
+    if key in waiters:
+      raise GizConnectionError('sequence number %s already in flight' % seq)
+    waiter = asyncio.get_event_loop().create_future()
+    waiters[key] = waiter
+    try:
+      await self.send(JSON.dumps_c2s_raw(did, self._enc.encode(frame, seq)))
+      return await asyncio.wait_for(waiter, timeout)
+    finally:
+      waiters.pop(key, None)
+
+  async def send_frame(self, did: str, frame: Union[CommandFrame, BoundFrame]):
+    """Sends frame to did without waiting for a reply."""
+    seq = self.seqs.next(did)
+    await self.send(JSON.dumps_c2s_raw(did, self._enc.encode(frame, seq)))
+    return seq
+
+  def subscribe(self, maxsize: int = 256):
+    sub = Subscription(self, maxsize)
+    self._subscriptions.add(sub)
+    return sub
+
+  def _publish(self, item):
+    for sub in self._subscriptions:
+      sub._put(item)
+
+  def _dispatch(self, js: dict, waiters: dict):
+    cmd = js.get('cmd')
+    if cmd == 's2c_raw':
+      did = js['data']['did']
+      frame = self._dec.decode_lazy(bytes(js['data']['raw']))
+      waiter = waiters.get((did, frame.seq_num, frame.frame_type))
+      if waiter is not None and not waiter.done():
+        waiter.set_result(frame)
+      else:
+        self._publish((did, frame))
+    elif cmd == 'login_res':
+      waiter = waiters.get('login_res')
+      if waiter is not None and not waiter.done():
+        waiter.set_result(js)
+    elif cmd != 'pong':
+      self._publish((None, js))
+
+  async def _read_loop(self, ws, waiters: dict):
+    error = GizConnectionError('connection lost')
+    try:
+      while True:
+        msg = await ws.recv()
+        try:
+          self._dispatch(JSON.loads(msg), waiters)
+        except Exception:
+          LOG.exception('failed to handle message %s', msg)
+    except websockets.ConnectionClosed as e:
+      error = e
+    except asyncio.CancelledError:
+      error = websockets.ConnectionClosed(1000, 'connection closed')
+      raise
+    except Exception as e:
+      LOG.exception('websocket reader failed')
+      error = e
+    finally:
+      if self._ws is ws:
+        self._ws = None
+        self._login_token = None
+      for waiter in list(waiters.values()):
+        if not waiter.done():
+          waiter.set_exception(error)
+      for sub in list(self._subscriptions):
+        sub._close(error)
+
+  async def ping(self):
+    await self.send(JSON.dumps({"cmd": "ping"}))
+
+  async def close(self):
+    ws, self._ws = self._ws, None
+    reader, self._reader = self._reader, None
+    self._login_token = None
+    if ws is not None:
+      await ws.close()
+    if reader is not None:
+      reader.cancel()
+
+
+class ConnectionPool:
+  """Authenticated websockets kept open per Gizwits uid.
+
+  Open connections are pinged every half heartbeat interval unless something
+  was sent meanwhile.  Idle ones are closed after idle_timeout seconds
+  without use, or when more than max_size are open.
+  """
+
+  def __init__(self,
+               url: str = _DEFAULT_URL,
+               appid: str = CONFIG['appid'],
+               heartbeat_interval: int = 180,
+               idle_timeout: int = 600,
+               max_size: int = 100):
+    self._url = url
+    self._appid = appid
+    self._heartbeat_interval = heartbeat_interval
+    self._idle_timeout = idle_timeout
+    self._max_size = max_size
+    self._conns = OrderedDict()
+    self._maintainer = None
+
+  def __len__(self):
+    return len(self._conns)
+
+  def _get(self, uid: str):
+    conn = self._conns.get(uid)
+    if conn is None:
+      conn = GizConnection(self._url, self._appid, self._heartbeat_interval)
+      self._conns[uid] = conn
+    self._conns.move_to_end(uid)
+    if self._maintainer is None or self._maintainer.done():
+      self._maintainer = asyncio.ensure_future(self._maintain())
+    return conn
+
+  @staticmethod
+  def _busy(conn: GizConnection):
+    return conn.active or conn.lock.locked()
+
+  async def run(self, token: GizToken, fn):
+    """Runs fn(conn) on the user's logged in connection.
+
+    Any number of calls can share the connection at once.  fn is retried
+    once on a fresh socket if the pooled one turns out to be closed.
+    """
+    conn = self._get(token.uid)
+    conn.active += 1
+    try:
+      for attempt in (1, 2):
+        async with conn.lock:
+          await conn.ensure(token)
+        try:
+          return await fn(conn)
+        except websockets.ConnectionClosed:
+          if attempt == 2:
+            raise
+          LOG.info('connection for %s closed, reconnecting', token.uid)
+    finally:
+      conn.active -= 1
+      conn.last_used = time.monotonic()
+      await self._evict_overflow()
+
+  async def _evict_overflow(self):
+    while len(self._conns) > self._max_size:
+      uid, conn = next(iter(self._conns.items()))
+      if self._busy(conn):
+        break
+      del self._conns[uid]
+      await conn.close()
+
+  async def _maintain(self):
+    interval = self._heartbeat_interval / 2
+    while self._conns:
+      await asyncio.sleep(interval)
+      now = time.monotonic()
+      for uid, conn in list(self._conns.items()):
+        if conn.lock.locked():
+          continue
+        try:
+          if not conn.active and (now - conn.last_used > self._idle_timeout or
+                                  not conn.is_open):
+            self._conns.pop(uid, None)
+            await conn.close()
+          # connections in use need the heartbeat too, e.g. while watched
+          elif conn.is_open and now - conn.last_sent > interval:
+            await conn.ping()
+        except websockets.ConnectionClosed:
+          await conn.close()
+        except Exception:
+          LOG.exception('heartbeat for %s failed', uid)
+
+  async def close(self):
+    if self._maintainer is not None:
+      self._maintainer.cancel()
+    conns, self._conns = self._conns, OrderedDict()
+    for conn in conns.values():
+      await conn.close()
+
+
+DEFAULT_POOL = ConnectionPool()
@@ -1,15 +1,19 @@
 import asyncio
 import logging
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List
 
 import websockets
 
+from .config import CONFIG
+from .connection import (CONNECT_TIMEOUT, DEFAULT_POOL, ConnectionPool,
+                         GizConnection, GizConnectionError)
 from .frame_constants import DataKeys
-from .frames import (DEFAULT_DECODER, DEFAULT_ENCODER, CommandFrame, FrameData,
-                     FrameDecoder, FrameEncoder, FrameType, Header)
+from .frames import CommandFrame, FrameData, FrameType, Header, LazyCommandFrame
 from .gizapi import GizApi, GizToken
-from .js import JSON
+from .runtime import RUNTIME
+from .state import STATE_CACHE, StateCache, device_id
+from .subscriber import DEFAULT_SUBSCRIBER, StateSubscriber
 
 LOG = logging.getLogger('discovery')
 
@@ -21,8 +25,32 @@ class Device:
   name: str
   closed_pct: int
 
+  @property
+  def id(self):
+    return device_id(self.did, self.channel)
 
-_LOOP = asyncio.get_event_loop()
+
+@dataclass
+class QueryResult:
+  # closed percentage by Device.id
+  positions: Dict[str, int]
+  # why a device has no position, by Device.id
+  errors: Dict[str, str]
+
+
+class IncompleteDiscoveryError(GizConnectionError):
+  """Raised by discover when some hubs didn't list their devices in time."""
+
+  def __init__(self, devices: List[Device], missing: List[str]):
+    super(IncompleteDiscoveryError,
+          self).__init__('no device list from %s' % ', '.join(missing))
+    # the devices of the hubs that did answer
+    self.devices = devices
+    self.missing = missing
+
+
+_DISCOVERY_TIMEOUT = CONFIG.get('discovery_timeout', 7)
+_QUERY_TIMEOUT = CONFIG.get('query_timeout', 3)
 
 
 class DeviceDiscovery:
@@ -30,117 +58,170 @@ class DeviceDiscovery:
   def __init__(self,
                api: GizApi,
                token: GizToken,
-               enc: FrameEncoder = None,
-               dec: FrameDecoder = None,
-               url: str = 'wss://ussandbox.gizwits.com:8880/ws/app/v1'):
-    self._url = url
+               pool: ConnectionPool = None,
+               states: StateCache = None,
+               subscriber: StateSubscriber = None):
     self._token = token
     self._api = api
-    self._enc = enc or DEFAULT_ENCODER
-    self._dec = dec or DEFAULT_DECODER
-
-  def _login_msg(self, token):
-    return JSON.dumps({
-        "cmd": "login_req",
-        "data": {
-            "appid": self._api.appid,
-            "uid": token.uid,
-            "token": token.token,
-            "p0_type": "custom",
-            "heartbeat_interval": 180,
-            "auto_subscribe": True
-        }
-    })
-
-  async def _send(self, ws, did: str, frame: CommandFrame):
-    await ws.send(
-        JSON.dumps({
-            "cmd": "c2s_raw",
-            "data": {
-                "did": did,
-                "raw": self._enc.encode(frame)
-            }
-        }))
-
-  async def _list_devices(self, ws, did):
+    # these have a len, so an empty one is falsy
+    self._pool = pool if pool is not None else DEFAULT_POOL
+    self._states = states if states is not None else STATE_CACHE
+    self._subscriber = (
+        subscriber if subscriber is not None else DEFAULT_SUBSCRIBER)
+
+  async def _list_devices(self, conn: GizConnection, dids: List[str],
+                          timeout: float):
     msg = CommandFrame(
         header=Header(0, 144, 5), frame_type=FrameType.DEVICE_LIST_REQ)
-    await self._send(ws, did, msg)
-
-    while True:
-      resp = await ws.recv()
-      js = JSON.loads(resp)
-      resp_did = js['data']['did']
-      if did == resp_did:
-        frame_data = bytes(js['data']['raw'])
-        decoded_frame = self._dec.decode(frame_data)
-        if decoded_frame.frame_type == FrameType.DEVICE_LIST_RESP:
-          return decoded_frame
-        else:
-          LOG.debug('ignoring unexpected frame %s' % decoded_frame)
+    requests = {
+        did: asyncio.ensure_future(
+            conn.request(did, msg, FrameType.DEVICE_LIST_RESP)) for did in dids
+    }
+    done = set()
+    if requests:
+      done, pending = await asyncio.wait(
+          list(requests.values()), timeout=timeout)
+      for f in pending:
+        f.cancel()
+
+    devices = []
+    for did, f in requests.items():
+      if f not in done:
+        LOG.warning('no device list from %s before the deadline', did)
+      elif f.exception() is not None:
+        raise f.exception()
       else:
-        LOG.info('ignoring unexected did')
+        devices.append((did, f.result()))
+    return devices
+
+  async def _discover(self, token: GizToken, dids: List[str], timeout: float):
+    # timeout is for the hubs to answer, connecting and logging in have their
+    # own
+    return await self._pool.run(
+        token, lambda conn: self._list_devices(conn, dids, timeout))
+
+  async def _query(self, token: GizToken, devices: List[Device],
+                   timeout: float):
+
+    async def _query_all(conn):
+      # every request goes out before any reply is awaited
+      results = await asyncio.gather(
+          *[self._query_device(conn, d, timeout) for d in devices],
+          return_exceptions=True)
+      ret = QueryResult({}, {})
+      for d, r in zip(devices, results):
+        if isinstance(r, websockets.ConnectionClosed):
+          raise r
+        elif isinstance(r, asyncio.TimeoutError):
+          ret.errors[d.id] = 'timeout'
+        elif isinstance(r, Exception):
+          LOG.warning('querying %s failed: %s', d.id, r)
+          ret.errors[d.id] = str(r) or type(r).__name__
+        elif r is None:
+          ret.errors[d.id] = 'no position reported'
+        else:
+          ret.positions[d.id] = r
+      return ret
 
-  async def _discover(self):
-    token = self._api.check_token(self._token)
-    bindings = self._api.list_bindings(token)
-    async with websockets.connect(self._url, ssl=True) as ws:
-      await ws.send(self._login_msg(token))
-      login_resp = await ws.recv()
-      devices = [(b.did, await self._list_devices(ws, b.did)) for b in bindings]
-      return devices
-
-  async def _query(self, devices: List[Device]):
-    token = self._api.check_token(self._token)
-    async with websockets.connect(self._url, ssl=True) as ws:
-      await ws.send(self._login_msg(token))
-      login_resp = await ws.recv()
-      devices = [
-          Device(d.did, d.channel, d.name, await self._query_device(ws, d))
-          for d in devices
-      ]
-      return devices
+    return await self._pool.run(token, _query_all)
 
-  async def _query_device(self, ws, d: Device):
+  async def _query_device(self, conn: GizConnection, d: Device, timeout: float):
     frame = CommandFrame(
         header=Header(0, 144, 5),
         frame_type=FrameType.DEVICE_PARA_REQ,
         data=[
             FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, d.channel),
         ])
-    await self._send(ws, d.did, frame)
-    await ws.recv()
-    resp = await ws.recv()
-    js = JSON.loads(resp)
-    frame_data = bytes(js['data']['raw'])
-    decoded = self._dec.decode(frame_data)
-    inner_para_data = [
-        f for f in decoded.data if f.key == DataKeys.INNER_PARA_DATA.value
-    ]
+    decoded = await conn.request(d.did, frame, FrameType.DEVICE_PARA_RESP,
+                                 timeout)
+    # seq nums alone could match a reply meant for another client
+    channel = decoded.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    if channel != d.channel:
+      raise GizConnectionError('reply for channel %s' %
+                               (channel.hex() if channel else None))
+    inner_para_data = decoded.get(DataKeys.INNER_PARA_DATA)
     if inner_para_data:
-      return inner_para_data[0].value[0]
+      return inner_para_data[0]
     else:
       return None
 
-  def discover(self):
-    devices: List[(str,
-                   CommandFrame)] = _LOOP.run_until_complete(self._discover())
+  def discover(self, timeout: float = _DISCOVERY_TIMEOUT):
+    """Lists the devices behind every hub the user has bound.
+
+    Raises IncompleteDiscoveryError if any hub hasn't answered within timeout
+    seconds of logging in.
+    """
+    token = self._api.check_token(self._token)
+    self._subscriber.watch(token)
+    dids = [b.did for b in self._api.list_bindings(token)]
+    devices: List[(str, LazyCommandFrame)] = RUNTIME.run(
+        self._discover(token, dids, timeout), timeout + 2 * CONNECT_TIMEOUT)
     ret = []
     for (did, d) in devices:
-      channels = [
-          c.value for c in d.data if c.key == DataKeys.DEVICE_ADDR_CHANNEL.value
-      ]
-      names = [c.value for c in d.data if c.key == DataKeys.NAME.value]
-      positions = [
-          int(c.value[1])
-          for c in d.data
-          if c.key == DataKeys.DEVICE_CMD_DATA.value
-      ]
+      channels = d.get_all(DataKeys.DEVICE_ADDR_CHANNEL)
+      names = d.get_all(DataKeys.NAME)
+      positions = [int(c[1]) for c in d.get_all(DataKeys.DEVICE_CMD_DATA)]
       ret += [
           Device(did, channel, name, position)
           for (channel, name, position) in zip(channels, names, positions)
       ]
+    for d in ret:
+      self._states.put(d.id, d.closed_pct)
+    answered = {did for did, _ in devices}
+    missing = [did for did in dids if did not in answered]
+    if missing:
+      raise IncompleteDiscoveryError(ret, missing)
     return ret
 
-  def query(self, devices: List[Device]):
-    return _LOOP.run_until_complete(self._query(devices))
+  def query(self, devices: List[Device], timeout: float = _QUERY_TIMEOUT):
+    """Returns devices with their current closed percentage.
+
+    The position is None for devices that didn't answer within timeout.
+    """
+    result = self.query_positions(devices, timeout)
+    return [
+        Device(d.did, d.channel, d.name, result.positions.get(d.id))
+        for d in devices
+    ]
+
+  def query_positions(self,
+                      devices: List[Device],
+                      timeout: float = _QUERY_TIMEOUT) -> QueryResult:
+    """Returns the position of all devices.
+
+    Positions come from the state cache where it has one, as long as the
+    user is watched (see StateSubscriber); requests to the remaining devices,
+    across all hubs, are pipelined on the user's connection and each device
+    gets timeout seconds to answer.  Devices without a position have their
+    reason in errors, also when the connection failed altogether.
+    """
+    token = self._api.check_token(self._token)
+    self._subscriber.watch(token)
+    result = QueryResult({}, {})
+    missing = []
+    # only a watched user's states are kept up to date
+    watched = self._subscriber.watching(token)
+    for d in devices:
+      state = self._states.get(d.id) if watched else None
+      if state is None or state.closed_pct is None:
+        missing.append(d)
+      elif not state.online:
+        result.errors[d.id] = 'offline'
+      else:
+        result.positions[d.id] = state.closed_pct
+    if not missing:
+      return result
+
+    try:
+      queried = RUNTIME.run(
+          self._query(token, missing, timeout), timeout + CONNECT_TIMEOUT)
+    except (websockets.ConnectionClosed, GizConnectionError, OSError,
+            asyncio.TimeoutError) as e:
+      LOG.warning('querying devices of %s failed: %r', token.uid, e)
+      error = str(e) or type(e).__name__
+      queried = QueryResult({}, {d.id: error for d in missing})
+    for dev_id, closed_pct in queried.positions.items():
+      self._states.put(dev_id, closed_pct)
+    result.positions.update(queried.positions)
+    result.errors.update(queried.errors)
+    return result
@@ -1,15 +1,24 @@
+import asyncio
+import logging
 import time
 from dataclasses import dataclass
+from typing import Union
 
-import requests
+import aiohttp
 
+from .cache import LRUCache
+from .coalescer import CommandCoalescer
 from .config import CONFIG
-from .frames import DEFAULT_ENCODER, CommandFrame, FrameEncoder
+from .frames import (DEFAULT_ENCODER, BoundFrame, CommandFrame, FrameEncoder,
+                     SequenceAllocators)
 from .js import JSON
+from .runtime import RUNTIME, Runtime
 
 _DEFAULT_APPID = CONFIG['appid']
 _ROOT_URL = 'https://usapi.gizwits.com/app/'
 
+LOG = logging.getLogger('gizapi')
+
 
 @dataclass
 class GizToken:
@@ -29,7 +38,106 @@ class GizAuthError(Exception):
   pass
 
 
-class GizApi:
+class GizControlError(Exception):
+  pass
+
+
+class _ActiveUser:
+
+  def __init__(self, token: GizToken):
+    self.token = token
+
+
+class TokenRefresher:
+  """Renews the tokens of recently active users before they expire.
+
+  Users count as active for active_window seconds after a request used
+  their token.  Every interval seconds, tokens expiring within margin
+  seconds are refreshed, so requests never wait for a login.  A user whose
+  login was refused isn't tried again until their password changes or a
+  login succeeds.
+  """
+
+  def __init__(self,
+               api: 'AsyncGizApi',
+               margin: int = CONFIG.get('token_refresh_margin', 86400),
+               interval: int = CONFIG.get('token_refresh_interval', 300),
+               active_window: int = CONFIG.get('token_active_window',
+                                               3 * 86400),
+               max_users: int = CONFIG.get('token_active_users', 10000)):
+    self._api = api
+    self._margin = margin
+    self._interval = interval
+    self._active = LRUCache(max_users, ttl=active_window)
+    # the password of users whose login was refused
+    self._refused = LRUCache(max_users, ttl=active_window)
+    self._task = None
+
+  def __len__(self):
+    return len(self._active)
+
+  def track(self, token: GizToken, active: bool = True):
+    """Records token as the user's current one; call on the api's loop.
+
+    active=False updates a tracked user's token without extending their
+    activity.
+    """
+    user = self._active.get(token.username)
+    if user is None:
+      if not active or self._refused.get(token.username) == token.password:
+        return
+      user = _ActiveUser(token)
+    # requests may still carry the token from before the last refresh
+    if (token.expire_at >= user.token.expire_at or
+        token.password != user.token.password):
+      user.token = token
+    if active:
+      self._active.put(token.username, user)
+      if self._task is None or self._task.done():
+        self._task = asyncio.ensure_future(self._run())
+
+  def logged_in(self, token: GizToken):
+    """Records a successful login for token's user."""
+    self._refused.pop(token.username)
+    self.track(token, active=False)
+
+  def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+
+  async def _run(self):
+    while len(self._active):
+      await asyncio.sleep(self._interval)
+      await self.refresh_due()
+
+  async def refresh_due(self):
+    """Refreshes every tracked token that expires within margin."""
+    deadline = int(time.time()) + self._margin
+    due = [
+        user.token
+        for _, user in self._active.items()
+        if user.token.expire_at <= deadline
+    ]
+    results = await asyncio.gather(
+        *[self._api.refresh(t) for t in due], return_exceptions=True)
+    for token, result in zip(due, results):
+      if isinstance(result, GizAuthError):
+        # retrying a wrong password could get the account locked
+        LOG.warning('login of %s refused, not refreshing it: %s',
+                    token.username, result)
+        self._active.pop(token.username)
+        self._refused.put(token.username, token.password)
+      elif isinstance(result, Exception):
+        LOG.warning('refreshing the token of %s failed: %s', token.username,
+                    result)
+
+
+class AsyncGizApi:
+  """The Gizwits REST API on a pooled aiohttp session.
+
+  The session is created on first use, on the loop of the first caller, and
+  must only be used from that loop.
+  """
   _TOKEN_UPDATE_HOOKS = []
 
   @classmethod
@@ -39,11 +147,27 @@ class GizApi:
   def __init__(self,
                root=_ROOT_URL,
                appid=_DEFAULT_APPID,
-               enc: FrameEncoder = None):
+               enc: FrameEncoder = None,
+               pool_size: int = CONFIG.get('giz_pool_size', 100),
+               keepalive_timeout: float = CONFIG.get('giz_keepalive_timeout',
+                                                     30),
+               timeout: float = CONFIG.get('giz_timeout', 10)):
     self._appid = appid
     self._root = root
-    self._session = requests.session()
     self._enc = enc or DEFAULT_ENCODER
+    self._seqs = SequenceAllocators()
+    self._pool_size = pool_size
+    self._keepalive_timeout = keepalive_timeout
+    self._timeout = timeout
+    self._session = None
+    # username -> the login refreshing its token
+    self._refreshes = {}
+    # tokens refreshed a moment ago, until callers see the stored one
+    self._refreshed = LRUCache(1000, ttl=60)
+    self.refresher = TokenRefresher(self)
+    self.coalescer = CommandCoalescer(self)
+    # sends control frames other than by http, see WebSocketTransport
+    self.transport = None
 
   @property
   def appid(self):
@@ -52,39 +176,81 @@ class GizApi:
   def _make_url(self, suffix):
     return '%s%s' % (self._root, suffix)
 
-  def check_token(self, token: GizToken):
+  def _get_session(self) -> aiohttp.ClientSession:
+    if self._session is None or self._session.closed:
+      connector = aiohttp.TCPConnector(
+          limit=self._pool_size, keepalive_timeout=self._keepalive_timeout)
+      self._session = aiohttp.ClientSession(
+          connector=connector,
+          timeout=aiohttp.ClientTimeout(total=self._timeout))
+    return self._session
+
+  async def check_token(self, token: GizToken):
+    """Returns token, or a fresh one if it has expired.
+
+    Concurrent calls for the same user share a single login, and the hooks
+    run once for it.
+    """
     if not token:
       return None
-    if token.expire_at <= int(time.time()):
-      new_token = self.login(token.username, token.password)
+    now = int(time.time())
+    if token.expire_at > now:
+      self.refresher.track(token)
+      return token
+    recent = self._refreshed.get(token.username)
+    if (recent is not None and recent.expire_at > now and
+        recent.password == token.password):
+      return recent
+    return await self.refresh(token)
+
+  async def refresh(self, token: GizToken):
+    """Logs in again for token's user, unless a login already is under way."""
+    refresh = self._refreshes.get(token.username)
+    if refresh is None:
+      refresh = asyncio.ensure_future(self._refresh_token(token))
+      self._refreshes[token.username] = refresh
+    # a caller giving up must not cancel the login the others wait for
+    return await asyncio.shield(refresh)
+
+  async def _refresh_token(self, token: GizToken):
+    try:
+      new_token = await self.login(token.username, token.password)
+      # hooks store the token, which blocks
+      loop = asyncio.get_event_loop()
       for h in self._TOKEN_UPDATE_HOOKS:
-        h(new_token)
+        await loop.run_in_executor(None, h, new_token)
+      self._refreshed.put(token.username, new_token)
+      self.refresher.logged_in(new_token)
       return new_token
-    else:
-      return token
+    finally:
+      del self._refreshes[token.username]
+
+  async def _post(self, suffix, json_obj, token: GizToken = None):
+    return await self._post_data(suffix, JSON.dumps(json_obj), token)
 
-  def _post(self, suffix, json_obj, token: GizToken = None):
-    token = self.check_token(token)
+  async def _post_data(self, suffix, data: str, token: GizToken = None):
+    token = await self.check_token(token)
     headers = {
         'X-Gizwits-Application-Id': self._appid,
         'Content-Type': 'application/json'
     }
     if token:
       headers['X-Gizwits-User-token'] = token.token
-    data = JSON.dumps(json_obj)
-    return self._session.post(
-        self._make_url(suffix), data=data, headers=headers).json()
+    async with self._get_session().post(
+        self._make_url(suffix), data=data, headers=headers) as resp:
+      return await resp.json(loads=JSON.loads, content_type=None)
 
-  def _get(self, suffix, token: GizToken = None):
-    token = self.check_token(token)
+  async def _get(self, suffix, token: GizToken = None):
+    token = await self.check_token(token)
     headers = {'X-Gizwits-Application-Id': self._appid}
     if token:
       headers['X-Gizwits-User-token'] = token.token
+    async with self._get_session().get(
+        self._make_url(suffix), headers=headers) as resp:
+      return await resp.json(loads=JSON.loads, content_type=None)
 
-    return self._session.get(self._make_url(suffix), headers=headers).json()
-
-  def login(self, username: str, password: str):
-    resp = self._post(
+  async def login(self, username: str, password: str):
+    resp = await self._post(
         'login', json_obj={
             'username': username,
             'password': password
@@ -93,11 +259,82 @@ class GizApi:
       raise GizAuthError(resp['error_message'])
     return GizToken(username=username, password=password, **resp)
 
-  def list_bindings(self, giz_token: GizToken):
-    resp = self._get('bindings', giz_token)
+  async def list_bindings(self, giz_token: GizToken):
+    resp = await self._get('bindings', giz_token)
     devices = resp['devices']
     return [Binding(d['did']) for d in devices]
 
-  def control(self, giz_token: GizToken, did: str, frame: CommandFrame):
-    msg = {"raw": self._enc.encode(frame)}
-    return self._post('control/%s' % did, msg, giz_token)
+  async def control(self, giz_token: GizToken, did: str,
+                    frame: Union[CommandFrame, BoundFrame]):
+    if self.transport is not None:
+      return await self.transport.control(giz_token, did, frame)
+    return await self.control_http(giz_token, did, frame)
+
+  async def control_http(self, giz_token: GizToken, did: str,
+                         frame: Union[CommandFrame, BoundFrame]):
+    raw = self._enc.encode(frame, self._seqs.next(did))
+    return await self._post_data('control/%s' % did, JSON.dumps_raw(raw),
+                                 giz_token)
+
+  def metrics(self):
+    """Counters of the command path, see /ping."""
+    ret = {'coalescer': self.coalescer.metrics()}
+    if self.transport is not None:
+      ret['transport'] = self.transport.metrics()
+    return ret
+
+  async def close(self):
+    self.refresher.stop()
+    if self._session is not None:
+      await self._session.close()
+
+
+class GizApi:
+  """Blocking calls into an AsyncGizApi running on the runtime's loop.
+
+  Must not be called from the runtime's loop itself; coroutines there use
+  aio directly.
+  """
+
+  @classmethod
+  def register_hook(cls, hook):
+    AsyncGizApi.register_hook(hook)
+
+  def __init__(self,
+               root=_ROOT_URL,
+               appid=_DEFAULT_APPID,
+               enc: FrameEncoder = None,
+               aio: AsyncGizApi = None,
+               runtime: Runtime = None):
+    self.aio = aio or AsyncGizApi(root, appid, enc)
+    self._runtime = runtime or RUNTIME
+
+  @property
+  def appid(self):
+    return self.aio.appid
+
+  def check_token(self, token: GizToken):
+    return self._runtime.run(self.aio.check_token(token))
+
+  def login(self, username: str, password: str):
+    return self._runtime.run(self.aio.login(username, password))
+
+  def list_bindings(self, giz_token: GizToken):
+    return self._runtime.run(self.aio.list_bindings(giz_token))
+
+  def control(self, giz_token: GizToken, did: str, frame: Union[CommandFrame,
+                                                                BoundFrame]):
+    return self._runtime.run(self.aio.control(giz_token, did, frame))
+
+  def control_latest(self, giz_token: GizToken, did: str, device_key: str,
+                     frame: Union[CommandFrame, BoundFrame]):
+    """Like control, but superseded by later commands for device_key.
+
+    See CommandCoalescer.
+    """
+    return self._runtime.run(
+        self.aio.coalescer.submit(giz_token, did, device_key, frame))
+
+  def refresh_tokens(self):
+    """Starts refreshing the tokens that are about to expire."""
+    self._runtime.submit(self.aio.refresher.refresh_due())
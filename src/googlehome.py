@@ -1,17 +1,32 @@
+import asyncio
 import json
 import logging
+from collections import OrderedDict
+from typing import List
 
 from authlib.flask.oauth2 import current_token
 from flask import Blueprint, request
 from src.auth.oauth2 import get_user_for_token, require_oauth
 
+from . import commands
+from .catalog import CATALOG
+from .config import CONFIG
 from .discovery import Device, DeviceDiscovery
-from .frame_constants import DataKeys
-from .frames import CommandFrame, FrameData, FrameType, Header, MotoCmd
-from .gizapi import GizApi, GizToken
+from .gizapi import GizApi, GizControlError, GizToken
+from .runtime import RUNTIME
 
 LOG = logging.getLogger(__name__)
 
+# the devices are spliced in already serialized, see CatalogCache.endpoints
+_SYNC_RESPONSE = ('{"requestId": %s, "payload": '
+                  '{"agentUserId": %s, "devices": %s}}')
+_EXECUTE_CONCURRENCY = CONFIG.get('execute_concurrency', 10)
+# devices not done by then are reported as failed, within Google's deadline
+_EXECUTE_TIMEOUT = CONFIG.get('execute_timeout', 7)
+# move all channels of a hub with one frame per batch_execute_max_channels
+_BATCH_EXECUTE = CONFIG.get('batch_execute', False)
+_BATCH_MAX_CHANNELS = CONFIG.get('batch_execute_max_channels', 8)
+
 
 class GoogleHome:
 
@@ -44,7 +59,7 @@ class GoogleHome:
   @staticmethod
   def _make_device(dev: Device):
     return {
-        'id': '%s#%s' % (dev.did, dev.channel.hex()),
+        'id': dev.id,
         'type': 'action.devices.types.BLINDS',
         'traits': ['action.devices.traits.OpenClose'],
         'name': {
@@ -61,62 +76,131 @@ class GoogleHome:
     }
 
   def _handle_sync(self, request_id, giz_token: GizToken):
-    discovery = DeviceDiscovery(self._api, giz_token)
-    devices = discovery.discover()
-    return json.dumps({
-        'requestId': request_id,
-        'payload': {
-            'agentUserId': giz_token.username,
-            'devices': [self._make_device(d) for d in devices]
-        }
-    })
+    catalog = CATALOG.get(self._api, giz_token)
+    devices = CATALOG.endpoints(catalog, 'google', self._make_device)
+    return _SYNC_RESPONSE % (json.dumps(request_id),
+                             json.dumps(giz_token.username), devices)
 
   def _handle_execute(self, request_id, payload, giz_token):
-    commands = payload['commands']
-    result_devices = []
-    result_pct = 0
-    for c in commands:
+    # the open percentages to move each device to, in order
+    plan = OrderedDict()
+    for c in payload['commands']:
       for d in c['devices']:
-        dev_id = d['id']
         data = d['customData']
-        did = data['did']
-        channel = bytes.fromhex(data['channelHex'])
-
-        result_devices.append(dev_id)
+        steps = plan.setdefault(
+            d['id'], (data['did'], bytes.fromhex(data['channelHex']), []))[2]
         for e in c['execution']:
           cmd = e['command']
           assert cmd == 'action.devices.commands.OpenClose'
-          pct = e['params']['openPercent']
-          frame = CommandFrame(
-              header=Header(0, 144, 5),
-              frame_type=FrameType.DEVICE_EXECUTE_REQ,
-              data=[
-                  FrameData(DataKeys.DEVICE_CMD.value,
-                            MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value),
-                  FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel),
-                  FrameData(DataKeys.DEVICE_CMD_DATA.value,
-                            bytes([1, 100 - pct, 0]))
-              ])
-          self._api.control(giz_token, did, frame)
-          result_pct = pct
-
-    return json.dumps({
-        'requestId': request_id,
-        'payload': {
-            'commands': [{
-                'ids': result_devices,
-                'status': 'SUCCESS',
-                'states': {
-                    "openPercent": result_pct,
-                    "online": True
-                }
-            }]
-        }
-    })
+          steps.append(e['params']['openPercent'])
+
+    giz_token = self._api.check_token(giz_token)
+    if _BATCH_EXECUTE:
+      units = OrderedDict()
+      for dev_id, (did, _, _) in plan.items():
+        units.setdefault(did, []).append(dev_id)
+      units = list(units.values())
+    else:
+      units = [[dev_id] for dev_id in plan]
+    # _execute gives up on its own, the extra second is for a busy loop
+    unit_results = RUNTIME.run(
+        self._execute(giz_token, plan, units, _EXECUTE_TIMEOUT),
+        _EXECUTE_TIMEOUT + 1)
+    # each device ends up at its last step, unless its unit failed
+    results = {}
+    for unit, error in zip(units, unit_results):
+      for dev_id in unit:
+        steps = plan[dev_id][2]
+        results[dev_id] = error or (steps[-1] if steps else None)
+
+    # one entry per outcome, so devices ending up alike share it
+    outcomes = OrderedDict()
+    for dev_id, result in results.items():
+      if isinstance(result, Exception):
+        LOG.warning('executing on %s failed: %s', dev_id, result)
+        key = ('ERROR', None)
+      else:
+        key = ('SUCCESS', result)
+      outcomes.setdefault(key, []).append(dev_id)
+
+    ret = []
+    for (status, pct), ids in outcomes.items():
+      if status == 'SUCCESS':
+        ret.append({
+            'ids': ids,
+            'status': status,
+            'states': {
+                'openPercent': pct,
+                'online': True
+            }
+        })
+      else:
+        ret.append({
+            'ids': ids,
+            'status': status,
+            'errorCode': 'transientError'
+        })
+    return json.dumps({'requestId': request_id, 'payload': {'commands': ret}})
+
+  async def _execute(self, giz_token: GizToken, plan: OrderedDict,
+                     units: List[List[str]], timeout: float):
+    """Moves every device through its steps.
+
+    Each unit is a list of device ids behind the same hub, moved together.
+    Units run concurrently, at most _EXECUTE_CONCURRENCY at a time; the
+    steps of each device run in order.  Returns None, or the error, for each
+    unit; units still running after timeout seconds are cancelled and get an
+    asyncio.TimeoutError.
+    """
+    limit = asyncio.Semaphore(_EXECUTE_CONCURRENCY)
+
+    async def _run(unit):
+      did = plan[unit[0]][0]
+      async with limit:
+        for i in range(max(len(plan[dev_id][2]) for dev_id in unit)):
+          targets = [(channel, 100 - steps[i])
+                     for _, channel, steps in map(plan.get, unit)
+                     if i < len(steps)]
+          for start in range(0, len(targets), _BATCH_MAX_CHANNELS):
+            batch = targets[start:start + _BATCH_MAX_CHANNELS]
+            if len(unit) == 1:
+              resp = await self._api.aio.coalescer.submit(
+                  giz_token, did, unit[0], commands.set_closed_pct(*batch[0]))
+            elif len(batch) == 1:
+              resp = await self._api.aio.control(
+                  giz_token, did, commands.set_closed_pct(*batch[0]))
+            else:
+              resp = await self._api.aio.control(
+                  giz_token, did, commands.set_closed_pcts(batch))
+            if 'error_message' in resp:
+              raise GizControlError(resp['error_message'])
+
+    tasks = [asyncio.ensure_future(_run(unit)) for unit in units]
+    if not tasks:
+      return []
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for t in pending:
+      t.cancel()
+    late = asyncio.TimeoutError('not done within %ss' % timeout)
+    return [t.exception() if t in done else late for t in tasks]
 
   def _handle_query(self, request_id, payload, giz_token):
+    devices = [
+        Device(d['customData']['did'],
+               bytes.fromhex(d['customData']['channelHex']), None, None)
+        for d in payload['devices']
+    ]
+    discovery = DeviceDiscovery(self._api, giz_token)
+    result = discovery.query_positions(devices)
     ret = {}
-    for d in payload['devices']:
-      device_id = d['id']
-      ret[device_id] = {'online': True}
+    for d in devices:
+      closed_pct = result.positions.get(d.id)
+      if closed_pct is None:
+        ret[d.id] = {'status': 'ERROR', 'errorCode': 'deviceOffline'}
+      else:
+        ret[d.id] = {
+            'status': 'SUCCESS',
+            'online': True,
+            'openPercent': 100 - closed_pct
+        }
     return json.dumps({'requestId': request_id, 'payload': {'devices': ret}})
@@ -1,21 +1,49 @@
 import json
+from json.encoder import encode_basestring_ascii
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
 
 
 class _BytesJSONEncoder(json.JSONEncoder):
 
   def default(self, o):
-    if isinstance(o, bytes) or isinstance(o, bytearray):
-      return [int(b & 0xFF) for b in o]
+    if isinstance(o, (bytes, bytearray, memoryview)):
+      return list(o)
     else:
       return super(_BytesJSONEncoder, self).default(o)
 
 
+# Text of every byte value, so raw frames are serialized with one lookup per
+# byte instead of an int -> str conversion.
+_BYTE_TEXT = tuple(str(b) for b in range(256))
+
+
+def _raw_array(raw):
+  return '[%s]' % ', '.join(map(_BYTE_TEXT.__getitem__, raw))
+
+
 class JSON:
 
   @staticmethod
   def dumps(obj):
     return json.dumps(obj, cls=_BytesJSONEncoder)
 
+  @staticmethod
+  def dumps_raw(raw: bytes):
+    """Same as dumps({'raw': raw}), the body of a control request."""
+    return '{"raw": %s}' % _raw_array(raw)
+
+  @staticmethod
+  def dumps_c2s_raw(did: str, raw: bytes):
+    """Same as dumps of a c2s_raw websocket message for did."""
+    return '{"cmd": "c2s_raw", "data": {"did": %s, "raw": %s}}' % (
+        encode_basestring_ascii(did), _raw_array(raw))
+
   @staticmethod
   def loads(value):
+    if orjson is not None:
+      return orjson.loads(value)
     return json.loads(value)
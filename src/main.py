@@ -1,3 +1,4 @@
+import json
 import logging
 
 from flask import Flask
@@ -5,12 +6,15 @@ from flask.sessions import SecureCookieSessionInterface
 from itsdangerous import URLSafeTimedSerializer
 
 from src.alexa import Alexa
+from src.auth.datastore import TokenRepo
 from src.auth.oauth2 import OAuth, config_oauth
 from src.config import CONFIG
 from src.gizapi import GizApi
 from src.googlehome import GoogleHome
+from src.transport import WebSocketTransport
 
 logging.basicConfig(level='INFO')
+LOG = logging.getLogger('main')
 
 if CONFIG.get('enable_debugger', False):
   try:
@@ -39,6 +43,8 @@ app.config.update({'OAUTH2_REFRESH_TOKEN_GENERATOR': True})
 app.session_interface = KmsSecureCookieSessionInterface()
 
 api = GizApi()
+if CONFIG.get('ws_commands', False):
+  api.aio.transport = WebSocketTransport(api.aio)
 alexa = Alexa(api)
 oauth = OAuth(api)
 gh = GoogleHome(api)
@@ -51,6 +57,10 @@ app.register_blueprint(gh.bp, uri_prefix='')
 
 @app.route('/ping')
 def ping():
+  # cron calls this every few minutes
+  api.refresh_tokens()
+  metrics = dict(api.aio.metrics(), tokens=TokenRepo.cache_metrics())
+  LOG.info('metrics: %s', json.dumps(metrics))
   return 'pong'
 
 
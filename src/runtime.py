@@ -0,0 +1,88 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+
+class Runtime:
+  """An asyncio event loop running forever on its own daemon thread.
+
+  Request threads hand coroutines to it with run, or submit when they don't
+  want to wait; coroutines already running on another loop use run_async.
+  The thread starts on first use, and again in a forked child process.
+  """
+
+  def __init__(self, name: str = 'runtime'):
+    self._name = name
+    self._lock = threading.Lock()
+    self._loop = None
+    self._thread = None
+    self._pid = None
+
+  @property
+  def loop(self) -> asyncio.AbstractEventLoop:
+    if self._pid != os.getpid():
+      self.start()
+    return self._loop
+
+  def start(self):
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      loop = asyncio.new_event_loop()
+      thread = threading.Thread(
+          target=self._run_forever, args=(loop,), name=self._name, daemon=True)
+      thread.start()
+      self._loop, self._thread, self._pid = loop, thread, os.getpid()
+
+  @staticmethod
+  def _run_forever(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    try:
+      loop.run_forever()
+    finally:
+      loop.close()
+
+  def in_loop(self):
+    return threading.current_thread() is self._thread
+
+  def submit(self, coro):
+    """Schedules coro on the loop, returning a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+  def call_soon(self, fn, *args):
+    self.loop.call_soon_threadsafe(fn, *args)
+
+  def run(self, coro, timeout: float = None):
+    """Runs coro on the loop and blocks until it finishes.
+
+    Raises asyncio.TimeoutError, after cancelling coro, if it takes longer
+    than timeout seconds.
+    """
+    if self.in_loop():
+      coro.close()
+      raise RuntimeError('Runtime.run would block its own loop')
+    future = self.submit(coro)
+    try:
+      return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+      future.cancel()
+      raise asyncio.TimeoutError()
+
+  async def run_async(self, coro, timeout: float = None):
+    """Awaits coro on the runtime's loop from any loop."""
+    if self.in_loop():
+      return await asyncio.wait_for(coro, timeout)
+    return await asyncio.wait_for(
+        asyncio.wrap_future(self.submit(coro)), timeout)
+
+  def stop(self):
+    with self._lock:
+      if self._pid != os.getpid():
+        return
+      self._loop.call_soon_threadsafe(self._loop.stop)
+      self._thread.join()
+      self._loop, self._thread, self._pid = None, None, None
+
+
+RUNTIME = Runtime()
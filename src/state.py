@@ -0,0 +1,71 @@
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from .cache import LRUCache
+from .config import CONFIG
+from .frame_constants import DataKeys
+from .frames import FrameType, LazyCommandFrame
+
+
+def device_id(did: str, channel: bytes):
+  return '%s#%s' % (did, channel.hex())
+
+
+@dataclass
+class DeviceState:
+  closed_pct: Optional[int]
+  online: bool
+  # wall clock time of the last report from the device
+  last_seen: float
+
+
+class StateCache:
+  """The last known state of each device, by device id (did#channel).
+
+  Fed by position queries and by the frames hubs push on their own; entries
+  nobody refreshed for max_age seconds are dropped.
+  """
+
+  def __init__(self,
+               max_size: int = CONFIG.get('state_cache_size', 10000),
+               max_age: float = CONFIG.get('state_max_age', 900)):
+    self._states = LRUCache(max_size, ttl=max_age)
+
+  def __len__(self):
+    return len(self._states)
+
+  def get(self, dev_id: str) -> Optional[DeviceState]:
+    return self._states.get(dev_id)
+
+  def put(self, dev_id: str, closed_pct: Optional[int], online: bool = True):
+    if closed_pct is None:
+      prev = self._states.get(dev_id)
+      closed_pct = prev.closed_pct if prev is not None else None
+    state = DeviceState(closed_pct, online, time.time())
+    self._states.put(dev_id, state)
+    return state
+
+  def update(self, did: str, frame: LazyCommandFrame):
+    """Records the state reported by a frame pushed from did.
+
+    Returns the device id the frame was about, or None if it doesn't carry a
+    device state.
+    """
+    channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    if channel is None:
+      return None
+    if frame.frame_type == FrameType.DEVICE_STATUS_RESP:
+      cmd_data = frame.get(DataKeys.DEVICE_CMD_DATA)
+      closed_pct = cmd_data[1] if cmd_data and len(cmd_data) > 1 else None
+    elif frame.frame_type == FrameType.DEVICE_PARA_RESP:
+      para_data = frame.get(DataKeys.INNER_PARA_DATA)
+      closed_pct = para_data[0] if para_data else None
+    else:
+      return None
+    dev_id = device_id(did, channel)
+    self.put(dev_id, closed_pct, DataKeys.ERROR not in frame)
+    return dev_id
+
+
+STATE_CACHE = StateCache()
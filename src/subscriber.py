@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from .config import CONFIG
+from .connection import DEFAULT_POOL, ConnectionPool, GizConnection
+from .gizapi import GizToken
+from .runtime import RUNTIME, Runtime
+from .state import STATE_CACHE, StateCache
+
+LOG = logging.getLogger('subscriber')
+
+
+class _Watch:
+
+  def __init__(self, token: GizToken):
+    self.token = token
+    self.task = None
+    self.last_used = time.monotonic()
+
+
+class StateSubscriber:
+  """Keeps a connection open for each active user to record what hubs push.
+
+  Hubs push DEVICE_STATUS_RESP and DEVICE_PARA_RESP frames to logged in
+  sockets (see auto_subscribe) whenever a blind moves; these go into the
+  state cache.  A user stays watched for idle_timeout seconds after the last
+  call to watch; past max_users the least recently active user is dropped.
+  """
+
+  def __init__(self,
+               cache: StateCache = None,
+               pool: ConnectionPool = None,
+               runtime: Runtime = None,
+               idle_timeout: float = CONFIG.get('subscriber_idle_timeout', 900),
+               max_users: int = CONFIG.get('subscriber_max_users', 100)):
+    self._cache = cache if cache is not None else STATE_CACHE
+    self._pool = pool if pool is not None else DEFAULT_POOL
+    self._runtime = runtime or RUNTIME
+    self._idle_timeout = idle_timeout
+    self._max_users = max_users
+    self._watches = OrderedDict()
+
+  def __len__(self):
+    return len(self._watches)
+
+  def watch(self, token: GizToken):
+    """Starts or extends watching token's user; safe from any thread."""
+    self._runtime.call_soon(self._watch, token)
+
+  def watching(self, token: GizToken):
+    """Whether token's user is watched, i.e. pushes reach the cache."""
+    return token.uid in self._watches
+
+  def _watch(self, token: GizToken):
+    w = self._watches.get(token.uid)
+    if w is None:
+      w = self._watches[token.uid] = _Watch(token)
+    w.token = token
+    w.last_used = time.monotonic()
+    self._watches.move_to_end(token.uid)
+    if w.task is None or w.task.done():
+      w.task = asyncio.ensure_future(self._run(w))
+    while len(self._watches) > self._max_users:
+      _, oldest = self._watches.popitem(last=False)
+      oldest.task.cancel()
+
+  async def _run(self, w: _Watch):
+
+    async def _consume(conn: GizConnection):
+      sub = conn.subscribe()
+      try:
+        while True:
+          remaining = w.last_used + self._idle_timeout - time.monotonic()
+          if remaining <= 0:
+            return
+          try:
+            did, msg = await asyncio.wait_for(sub.get(), remaining)
+          except asyncio.TimeoutError:
+            continue
+          if did is not None:
+            self._cache.update(did, msg)
+      finally:
+        sub.close()
+
+    try:
+      await self._pool.run(w.token, _consume)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      LOG.exception('watching %s failed', w.token.uid)
+    finally:
+      if self._watches.get(w.token.uid) is w:
+        del self._watches[w.token.uid]
+
+
+DEFAULT_SUBSCRIBER = StateSubscriber()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from typing import Union
+
+import websockets
+
+from .config import CONFIG
+from .connection import (DEFAULT_POOL, ConnectionPool, GizConnection,
+                         GizConnectionError)
+from .frame_constants import DataKeys
+from .frames import BoundFrame, CommandFrame, FrameType
+from .gizapi import AsyncGizApi, GizToken
+
+LOG = logging.getLogger('transport')
+
+
+class _Timings:
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def add(self, seconds: float):
+    self.count += 1
+    self.total += seconds
+    self.max = max(self.max, seconds)
+
+  def summary(self):
+    mean = self.total / self.count if self.count else 0.0
+    return {'count': self.count, 'mean': mean, 'max': self.max}
+
+
+def _channel_of(frame: Union[CommandFrame, BoundFrame]):
+  if isinstance(frame, BoundFrame):
+    return frame.values.get('channel')
+  return frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+
+
+class WebSocketTransport:
+  """Sends control frames as c2s_raw on the user's pooled websocket.
+
+  With wait_ack, each command waits up to ack_timeout seconds for the hub
+  to push a DEVICE_STATUS_RESP for the channel.  Like the HTTP control
+  call, control returns {'error_message': ...} when the hub reports an
+  error, goes offline or doesn't acknowledge in time.  Without wait_ack a
+  frame written to the socket counts as sent.  Commands fall back to the
+  HTTP control call when they can't be written to a socket.
+  """
+
+  def __init__(self,
+               api: AsyncGizApi,
+               pool: ConnectionPool = None,
+               wait_ack: bool = CONFIG.get('ws_command_ack', True),
+               ack_timeout: float = CONFIG.get('ws_command_ack_timeout', 2)):
+    self._api = api
+    self._pool = pool if pool is not None else DEFAULT_POOL
+    self._wait_ack = wait_ack
+    self._ack_timeout = ack_timeout
+    # time to write the frame, and until the hub acknowledged it
+    self.sent = _Timings()
+    self.confirmed = _Timings()
+    self.unconfirmed = 0
+    self.rejected = 0
+    self.fallbacks = 0
+
+  def metrics(self):
+    return {
+        'sent': self.sent.summary(),
+        'confirmed': self.confirmed.summary(),
+        'unconfirmed': self.unconfirmed,
+        'rejected': self.rejected,
+        'fallbacks': self.fallbacks
+    }
+
+  async def control(self, giz_token: GizToken, did: str,
+                    frame: Union[CommandFrame, BoundFrame]):
+    giz_token = await self._api.check_token(giz_token)
+    try:
+      return await self._pool.run(giz_token,
+                                  lambda conn: self._send(conn, did, frame))
+    except (websockets.ConnectionClosed, GizConnectionError, OSError,
+            asyncio.TimeoutError) as e:
+      LOG.warning('no websocket for %s, using http: %r', giz_token.uid, e)
+      self.fallbacks += 1
+    return await self._api.control_http(giz_token, did, frame)
+
+  async def _send(self, conn: GizConnection, did: str,
+                  frame: Union[CommandFrame, BoundFrame]):
+    sub = conn.subscribe(64) if self._wait_ack else None
+    try:
+      start = time.monotonic()
+      await conn.send_frame(did, frame)
+      self.sent.add(time.monotonic() - start)
+      if sub is None:
+        return {}
+      # past this point the frame is out, so a lost socket must not make
+      # the pool send it again
+      try:
+        resp = await asyncio.wait_for(
+            self._wait_for_ack(sub, did, _channel_of(frame)), self._ack_timeout)
+      except (asyncio.TimeoutError, websockets.ConnectionClosed,
+              GizConnectionError):
+        LOG.info('no acknowledgement from %s', did)
+        self.unconfirmed += 1
+        return {'error_message': 'no acknowledgement from %s' % did}
+      if 'error_message' in resp:
+        LOG.info('%s rejected a command: %s', did, resp['error_message'])
+        self.rejected += 1
+      else:
+        self.confirmed.add(time.monotonic() - start)
+      return resp
+    finally:
+      if sub is not None:
+        sub.close()
+
+  @staticmethod
+  async def _wait_for_ack(sub, did: str, channel: bytes):
+    """Returns {} once the hub acknowledged, or the error it reported."""
+    while True:
+      resp_did, resp = await sub.get()
+      if resp_did is None:
+        data = resp.get('data') or {}
+        if data.get('did', did) != did:
+          continue
+        if resp.get('cmd') == 's2c_invalid_msg':
+          return {
+              'error_message': data.get('msg', 'invalid message'),
+              'error_code': data.get('error_code')
+          }
+        if (resp.get('cmd') == 's2c_online_status' and
+            data.get('online') is False):
+          return {'error_message': '%s is offline' % did}
+      elif (resp_did == did and
+            resp.frame_type == FrameType.DEVICE_STATUS_RESP and
+            (channel is None or
+             resp.get(DataKeys.DEVICE_ADDR_CHANNEL) == channel)):
+        if DataKeys.ERROR in resp:
+          return {
+              'error_message': 'device error',
+              'error_code': resp.get(DataKeys.ERROR)
+          }
+        return {}
@@ -0,0 +1,155 @@
+"""Benchmark runner for the codec and request hot paths.
+
+Each bench_*.py module next to this file exposes BENCHMARKS, a list of
+(name, fn) pairs.  Every fn is timed with timeit (best of several repeats)
+and divided by the time of a fixed pure-Python calibration loop, so a
+baseline recorded on one machine stays meaningful on another.  Calibration
+doesn't cancel out interpreter versions though, whose stdlib and bytecode
+speed up unevenly, so the baseline records the interpreter it was taken
+with; run on another one, the comparison is printed but doesn't fail.
+
+Run from the repo root with the package importable (tox -e bench, or
+PYTHONPATH=. python tests/bench.py):
+
+  python tests/bench.py                 # run and compare to the baseline
+  python tests/bench.py --save          # record a new baseline
+  python tests/bench.py -k encode       # only benchmarks matching 'encode'
+
+Exits non-zero when a benchmark is slower than the baseline by more than
+--threshold (default 1.3x), on the interpreter the baseline was taken with.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import timeit
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_BASELINE = os.path.join(_HERE, 'bench_baseline.json')
+_MODULES = ['bench_codec', 'bench_js', 'bench_handlers']
+_CALIBRATION = 'calibration'
+# baseline key of the interpreter the times were taken with
+_INTERPRETER = 'interpreter'
+
+
+def _interpreter():
+  return '%s %d.%d' % (platform.python_implementation(), sys.version_info.major,
+                       sys.version_info.minor)
+
+
+def _calibration():
+  acc = 0
+  for i in range(200):
+    acc += i * i
+  return acc
+
+
+def measure(fn, repeat=7):
+  """Returns the best time of one call to fn, in seconds."""
+  timer = timeit.Timer(fn)
+  number, _ = timer.autorange()
+  return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _load(module_names):
+  benchmarks = []
+  for name in module_names:
+    try:
+      mod = importlib.import_module(name)
+    except ImportError as e:
+      # only optional third party dependencies may be missing
+      if not e.name or e.name.split('.')[0] in ('src', 'bench'):
+        raise
+      print('%-46s skipped (%s)' % (name, e))
+      continue
+    benchmarks += mod.BENCHMARKS
+  return benchmarks
+
+
+def run(benchmarks, pattern=None, repeat=7):
+  results = {}
+  calib = measure(_calibration, repeat=repeat)
+  for name, fn in benchmarks:
+    if pattern and pattern not in name:
+      continue
+    results[name] = measure(fn, repeat=repeat)
+  # calibrate on both sides of the run so a noisy start doesn't skew it
+  results[_CALIBRATION] = min(calib, measure(_calibration, repeat=repeat))
+  return results
+
+
+def normalize(results):
+  calib = results[_CALIBRATION]
+  return {
+      name: t / calib for name, t in results.items() if name != _CALIBRATION
+  }
+
+
+def compare(results, baseline, threshold):
+  """Prints results next to the baseline and returns the regressed names.
+
+  The baseline holds normalized times, see normalize.
+  """
+  normalized = normalize(results)
+  regressed = []
+  for name, t in results.items():
+    if name == _CALIBRATION:
+      continue
+    line = '%-46s %10.2f us' % (name, t * 1e6)
+    base = baseline.get(name)
+    if base:
+      ratio = normalized[name] / base
+      line += '   %5.2fx baseline' % ratio
+      if ratio > threshold:
+        line += '  REGRESSION'
+        regressed.append(name)
+    print(line)
+  return regressed
+
+
+def main(benchmarks=None, argv=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-k', dest='pattern', help='only run matching names')
+  parser.add_argument('--repeat', type=int, default=7)
+  parser.add_argument('--threshold', type=float, default=1.3)
+  parser.add_argument('--baseline', default=_BASELINE)
+  parser.add_argument(
+      '--save', action='store_true', help='write results as the baseline')
+  args = parser.parse_args(argv)
+
+  if benchmarks is None:
+    benchmarks = _load(_MODULES)
+  results = run(benchmarks, args.pattern, args.repeat)
+
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as fp:
+      baseline = json.load(fp)
+  interpreter = _interpreter()
+  recorded = baseline.pop(_INTERPRETER, None)
+  same_interpreter = recorded == interpreter
+  if baseline and not same_interpreter:
+    print('the baseline was taken with %s, not %s: regressions are only '
+          'indicative' % (recorded or 'an unknown interpreter', interpreter))
+  regressed = compare(results, baseline, args.threshold)
+
+  if args.save:
+    if not same_interpreter:
+      baseline = {}
+    baseline.update(normalize(results))
+    baseline[_INTERPRETER] = interpreter
+    with open(args.baseline, 'w') as fp:
+      json.dump(baseline, fp, indent=2, sort_keys=True)
+      fp.write('\n')
+    return 0
+  if regressed and same_interpreter:
+    print('%d benchmark(s) regressed more than %.2fx' %
+          (len(regressed), args.threshold))
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,99 @@
+"""Benchmarks for the frame codec and its binary primitives, see bench.py."""
+import sys
+
+import bench
+from src import commands
+from src.binary_reader import BinaryReader
+from src.binary_writer import BinaryWriter
+from src.frame_constants import DataKeys
+from src.frames import (CommandFrame, FastFrameEncoder, FrameData, FrameDecoder,
+                        FrameEncoder, FrameType, Header, MotoCmd)
+
+_CHANNEL = bytes([0x12, 0x34, 1])
+
+
+def _execute_frame(pct):
+  return CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_EXECUTE_REQ,
+      data=[
+          FrameData(DataKeys.DEVICE_CMD.value,
+                    MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value),
+          FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, _CHANNEL),
+          FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, pct, 0]))
+      ])
+
+
+def _device_list_resp(n):
+  data = []
+  for i in range(n):
+    data += [
+        FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, bytes([0x10, i, 1])),
+        FrameData(DataKeys.NAME.value, 'blind %d' % i),
+        FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, i, 0])),
+        FrameData(DataKeys.DEVICE_TYPE.value, 0x0102),
+    ]
+  return FrameEncoder().encode(
+      CommandFrame(
+          header=Header(0, 145, 6),
+          frame_type=FrameType.DEVICE_LIST_RESP,
+          data=data))
+
+
+_DEVICE_LIST_RESP = _device_list_resp(30)
+
+
+_ENC = FrameEncoder()
+_FAST = FastFrameEncoder()
+_DEC = FrameDecoder()
+
+
+def _writer_primitives():
+  w = BinaryWriter(bytearray(), '<')
+  for i in range(16):
+    w.put(i)
+    w.put_short(i)
+    w.put_int(i)
+    w.put_bytes(_CHANNEL)
+  return w.to_bytes()
+
+
+_PRIMITIVES = _writer_primitives()
+
+
+def _reader_primitives():
+  r = BinaryReader(_PRIMITIVES, '<')
+  for _ in range(16):
+    r.get()
+    r.get_short()
+    r.get_int()
+    r.get_bytes(3)
+
+
+def _varint_round_trip():
+  w = BinaryWriter(bytearray(), '>')
+  for v in (1, 127, 128, 300, 16384, 2**21):
+    w.put_varint(v)
+  r = BinaryReader(w.to_bytes(), '>')
+  for _ in range(6):
+    r.get_varint()
+
+
+# the encode benchmarks include building the frame, as the request handlers do
+BENCHMARKS = [
+    ('codec: FrameEncoder.encode', lambda: _ENC.encode(_execute_frame(40))),
+    ('codec: FastFrameEncoder.encode',
+     lambda: _FAST.encode(_execute_frame(40))),
+    ('codec: FrameTemplate encode',
+     lambda: _FAST.encode(commands.set_closed_pct(_CHANNEL, 40))),
+    ('codec: FrameDecoder.decode (30 devices)',
+     lambda: _DEC.decode(_DEVICE_LIST_RESP)),
+    ('codec: FrameDecoder.decode_lazy (30 devices)',
+     lambda: _DEC.decode_lazy(_DEVICE_LIST_RESP).get_all(DataKeys.NAME)),
+    ('codec: BinaryWriter primitives x16', _writer_primitives),
+    ('codec: BinaryReader primitives x16', _reader_primitives),
+    ('codec: put_varint/get_varint x6', _varint_round_trip),
+]
+
+if __name__ == '__main__':
+  sys.exit(bench.main(BENCHMARKS))
@@ -0,0 +1,275 @@
+"""Benchmarks for the Alexa and Google Home request handlers, see bench.py.
+
+Gizwits, its websocket and Datastore are replaced by in-process fakes, so these
+measure our own per-request cost: token lookup, frame encoding, JSON and
+Flask.  Needs the full requirements.txt installed and the repo root as working
+directory (for config.example.json).
+"""
+import asyncio
+import dataclasses
+import sys
+import time
+
+import bench
+from fake_datastore import FakeDatastoreClient
+from flask import Flask
+from src import discovery
+from src.alexa import Alexa
+from src.auth import crypto, datastore
+from src.auth.models import OAuth2Token, User
+from src.catalog import CATALOG
+from src.coalescer import CommandCoalescer
+from src.frame_constants import DataKeys
+from src.frames import (DEFAULT_DECODER, DEFAULT_ENCODER, CommandFrame,
+                        FrameData, FrameType, Header)
+from src.gizapi import AsyncGizApi, GizApi
+from src.googlehome import GoogleHome
+from src.subscriber import StateSubscriber
+
+_BEARER = 'bench-token'
+_DID = 'benchdid0123456789'
+_CHANNELS = ['10%02x01' % i for i in range(8)]
+
+
+class _PlainCrypto:
+
+  def encrypt(self, data):
+    return data
+
+  def decrypt(self, encrypted_data):
+    return encrypted_data
+
+
+class FakeAsyncGizApi(AsyncGizApi):
+  """Encodes and serializes requests as usual, but never sends them."""
+
+  def __init__(self):
+    super(FakeAsyncGizApi, self).__init__(root='http://gizwits.invalid/')
+    # measure the queueing, not the debounce wait
+    self.coalescer = CommandCoalescer(self, window=0)
+    self.posted = 0
+
+  async def _post_data(self, suffix, data, token=None):
+    await self.check_token(token)
+    self.posted += 1
+    return {}
+
+  async def _get(self, suffix, token=None):
+    await self.check_token(token)
+    return {'devices': [{'did': _DID}]}
+
+
+class FakeConnection:
+  """Answers every position query from a canned DEVICE_PARA_RESP."""
+
+  _PARA_RESPS = {
+      bytes.fromhex(channel_hex): DEFAULT_ENCODER.encode(
+          CommandFrame(
+              Header(0, 145, 6),
+              FrameType.DEVICE_PARA_RESP,
+              data=[
+                  FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value,
+                            bytes.fromhex(channel_hex)),
+                  FrameData(DataKeys.INNER_PARA_DATA.value, b'\x28')
+              ])) for channel_hex in _CHANNELS
+  }
+
+  _LIST_RESP = DEFAULT_ENCODER.encode(
+      CommandFrame(
+          Header(0, 145, 6),
+          FrameType.DEVICE_LIST_RESP,
+          data=[
+              d for i, channel_hex in enumerate(_CHANNELS) for d in (
+                  FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value,
+                            bytes.fromhex(channel_hex)),
+                  FrameData(DataKeys.NAME.value, 'blind %d' % i),
+                  FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, 40, 0])))
+          ]))
+
+  async def request(self, did, frame, resp_type, timeout=None):
+    DEFAULT_ENCODER.encode(frame, 0)
+    if resp_type == FrameType.DEVICE_LIST_RESP:
+      return DEFAULT_DECODER.decode_lazy(self._LIST_RESP)
+    channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    return DEFAULT_DECODER.decode_lazy(self._PARA_RESPS[channel])
+
+  def subscribe(self):
+    return FakeSubscription()
+
+
+class FakeSubscription:
+  """Nothing is ever pushed."""
+
+  async def get(self):
+    await asyncio.get_event_loop().create_future()
+
+  def close(self):
+    pass
+
+
+class FakeConnectionPool:
+
+  async def run(self, token, fn):
+    return await fn(FakeConnection())
+
+
+def _setup():
+  client = FakeDatastoreClient()
+  datastore._CLIENT = client
+  crypto.PASSWORD = _PlainCrypto()
+  discovery.DEFAULT_POOL = FakeConnectionPool()
+  discovery.DEFAULT_SUBSCRIBER = StateSubscriber(pool=FakeConnectionPool())
+  far_future = int(time.time()) + 10 * 365 * 86400
+  datastore.UserRepo.put_user(
+      User('bench', 'password', 'giztoken', 'gizuid', far_future))
+  token = OAuth2Token(_BEARER, 'Bearer', 'test', far_future, 'bench')
+  client.put(
+      _entity((datastore.TokenRepo.KIND, _BEARER), dataclasses.asdict(token)))
+
+  app = Flask(__name__)
+  api = GizApi(aio=FakeAsyncGizApi())
+  return app, Alexa(api), GoogleHome(api)
+
+
+def _entity(key, values):
+  ent = datastore.Entity(key)
+  ent.update(values)
+  return ent
+
+
+_APP, _ALEXA, _GOOGLE = _setup()
+
+_ALEXA_SET_PCT = {
+    'directive': {
+        'header': {
+            'namespace': 'Alexa.PercentageController',
+            'name': 'SetPercentage',
+            'correlationToken': 'bench'
+        },
+        'endpoint': {
+            'scope': {
+                'type': 'BearerToken',
+                'token': _BEARER
+            },
+            'endpointId': '%s#%s' % (_DID, _CHANNELS[0]),
+            'cookie': {
+                'did': _DID,
+                'channelHex': _CHANNELS[0]
+            }
+        },
+        'payload': {
+            'percentage': 40
+        }
+    }
+}
+
+
+_ALEXA_REPORT_STATE = {
+    'directive': {
+        'header': dict(
+            _ALEXA_SET_PCT['directive']['header'],
+            namespace='Alexa',
+            name='ReportState'),
+        'endpoint': _ALEXA_SET_PCT['directive']['endpoint'],
+        'payload': {}
+    }
+}
+
+_ALEXA_DISCOVER = {
+    'directive': {
+        'header': {
+            'namespace': 'Alexa.Discovery',
+            'name': 'Discover'
+        },
+        'payload': {
+            'scope': {
+                'type': 'BearerToken',
+                'token': _BEARER
+            }
+        }
+    }
+}
+
+
+def _google_request(intent, payload):
+  return {
+      'requestId': 'bench',
+      'inputs': [{
+          'intent': intent,
+          'payload': payload
+      }]
+  }
+
+
+_GOOGLE_DEVICES = [{
+    'id': '%s#%s' % (_DID, c),
+    'customData': {
+        'did': _DID,
+        'channelHex': c
+    }
+} for c in _CHANNELS]
+
+_GOOGLE_EXECUTE = _google_request(
+    'action.devices.EXECUTE', {
+        'commands': [{
+            'devices': _GOOGLE_DEVICES,
+            'execution': [{
+                'command': 'action.devices.commands.OpenClose',
+                'params': {
+                    'openPercent': 60
+                }
+            }]
+        }]
+    })
+
+_GOOGLE_QUERY = _google_request('action.devices.QUERY',
+                                {'devices': _GOOGLE_DEVICES})
+
+_GOOGLE_SYNC = _google_request('action.devices.SYNC', {})
+
+
+def _alexa(body):
+
+  def _run():
+    with _APP.test_request_context(
+        '/alexa/directives', method='POST', json=body):
+      return _ALEXA.handle_request()
+
+  return _run
+
+
+def _uncached(handler):
+  """Runs handler with the catalog discovered and rendered from scratch."""
+
+  def _run():
+    CATALOG.invalidate('bench')
+    return handler()
+
+  return _run
+
+
+def _google(body):
+  headers = {'Authorization': 'Bearer %s' % _BEARER}
+
+  def _run():
+    with _APP.test_request_context(
+        '/googlehome', method='POST', json=body, headers=headers):
+      return _GOOGLE._handle_request()
+
+  return _run
+
+
+BENCHMARKS = [
+    ('handlers: Alexa SetPercentage', _alexa(_ALEXA_SET_PCT)),
+    ('handlers: Alexa ReportState', _alexa(_ALEXA_REPORT_STATE)),
+    ('handlers: Google EXECUTE (8 devices)', _google(_GOOGLE_EXECUTE)),
+    ('handlers: Google QUERY (8 devices)', _google(_GOOGLE_QUERY)),
+    ('handlers: Alexa Discover (8 devices)',
+     _uncached(_alexa(_ALEXA_DISCOVER))),
+    ('handlers: Alexa Discover, cached', _alexa(_ALEXA_DISCOVER)),
+    ('handlers: Google SYNC (8 devices)', _uncached(_google(_GOOGLE_SYNC))),
+    ('handlers: Google SYNC, cached', _google(_GOOGLE_SYNC)),
+]
+
+if __name__ == '__main__':
+  sys.exit(bench.main(BENCHMARKS))
@@ -0,0 +1,45 @@
+"""Benchmarks for serializing Gizwits raw frame messages, see bench.py."""
+import json
+import sys
+
+import bench
+from src import commands
+from src.frames import FastFrameEncoder
+from src.js import JSON
+
+_RAW = FastFrameEncoder().encode(commands.set_closed_pct(bytes([1, 2, 3]), 40))
+_MSG = JSON.dumps_c2s_raw('abcdefghijklmnopqrstuv', _RAW)
+
+
+class _PerByteJSONEncoder(json.JSONEncoder):
+  # the encoder JSON.dumps used originally, kept as a baseline
+
+  def default(self, o):
+    if isinstance(o, bytes) or isinstance(o, bytearray):
+      return [int(b & 0xFF) for b in o]
+    else:
+      return super(_PerByteJSONEncoder, self).default(o)
+
+
+def _c2s_raw(raw):
+  return {
+      'cmd': 'c2s_raw',
+      'data': {
+          'did': 'abcdefghijklmnopqrstuv',
+          'raw': raw
+      }
+  }
+
+
+BENCHMARKS = [
+    ('js: json.dumps c2s_raw (per byte)',
+     lambda: json.dumps(_c2s_raw(_RAW), cls=_PerByteJSONEncoder)),
+    ('js: JSON.dumps c2s_raw', lambda: JSON.dumps(_c2s_raw(_RAW))),
+    ('js: JSON.dumps_c2s_raw',
+     lambda: JSON.dumps_c2s_raw('abcdefghijklmnopqrstuv', _RAW)),
+    ('js: json.loads c2s_raw', lambda: json.loads(_MSG)),
+    ('js: JSON.loads c2s_raw', lambda: JSON.loads(_MSG)),
+]
+
+if __name__ == '__main__':
+  sys.exit(bench.main(BENCHMARKS))
@@ -0,0 +1,29 @@
+"""Fixtures and helpers shared by the tests."""
+import asyncio
+import time
+
+import pytest
+from src.gizapi import GizToken
+
+# a token that stays valid for the whole run
+TOKEN = GizToken('token', 'uid', int(time.time()) + 86400, 'user', 'pw')
+
+
+def run(coro):
+  """Runs coro to completion on a new event loop."""
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(coro)
+  finally:
+    loop.close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+  """A FakeGizwits that the connection pools connect to."""
+  pytest.importorskip('websockets')
+  from fake_gizwits import FakeGizwits
+  from src import connection
+  server = FakeGizwits()
+  monkeypatch.setattr(connection.websockets, 'connect', server.connect)
+  return server
@@ -0,0 +1,23 @@
+"""An in-memory stand-in for google.cloud.datastore.Client, for tests."""
+
+
+class FakeDatastoreClient:
+  """Just enough of google.cloud.datastore.Client for the repos."""
+
+  def __init__(self):
+    self._entities = {}
+    self.gets = 0
+
+  def key(self, kind, name):
+    return (kind, name)
+
+  def get(self, key):
+    self.gets += 1
+    ent = self._entities.get(key)
+    return dict(ent) if ent is not None else None
+
+  def put(self, entity):
+    self._entities[entity.key] = dict(entity)
+
+  def delete(self, key):
+    self._entities.pop(key, None)
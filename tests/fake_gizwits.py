@@ -0,0 +1,124 @@
+"""An in-process fake of the Gizwits websocket server, for tests.
+
+Install it with monkeypatch.setattr(connection.websockets, 'connect',
+server.connect).  Frames the app sends are decoded and handed to
+server.respond, which returns the frames to answer with.
+"""
+import asyncio
+
+import websockets
+from src.frame_constants import DataKeys
+from src.frames import (DEFAULT_DECODER, DEFAULT_ENCODER, CommandFrame,
+                        FrameData, FrameType, Header)
+from src.js import JSON
+
+
+def decode_request(raw: bytes):
+  """Decodes a frame the app sent; see FakeGizwits.requests."""
+  raw = bytearray(raw)
+  # the decoder only reads the action byte of cmd 145 frames, so patch the
+  # low byte of cmd (frames here have a one byte length)
+  raw[7] = 145
+  return DEFAULT_DECODER.decode_lazy(bytes(raw))
+
+
+def s2c_raw(did: str, frame_type: FrameType, seq: int, *data: FrameData):
+  frame = CommandFrame(Header(0, 145, 6), frame_type, data=list(data))
+  raw = DEFAULT_ENCODER.encode(frame, seq)
+  return {'cmd': 's2c_raw', 'data': {'did': did, 'raw': list(raw)}}
+
+
+def para_resp(did: str, seq: int, channel: bytes, closed_pct: int):
+  return s2c_raw(did, FrameType.DEVICE_PARA_RESP, seq,
+                 FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel),
+                 FrameData(DataKeys.INNER_PARA_DATA.value, bytes([closed_pct])))
+
+
+def status_resp(did: str, channel: bytes, closed_pct: int):
+  return s2c_raw(
+      did, FrameType.DEVICE_STATUS_RESP, 0,
+      FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel),
+      FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, closed_pct, 0])))
+
+
+class FakeSocket:
+
+  def __init__(self, server: 'FakeGizwits'):
+    self._server = server
+    self._incoming = asyncio.Queue()
+    self.open = True
+    self.sent = []
+
+  async def send(self, msg: str):
+    if not self.open:
+      raise websockets.ConnectionClosed(1006, 'closed')
+    js = JSON.loads(msg)
+    self.sent.append(js)
+    for reply in self._server.handle(self, js):
+      self.push(reply)
+
+  async def recv(self):
+    msg = await self._incoming.get()
+    if msg is None:
+      raise websockets.ConnectionClosed(1006, 'closed')
+    return msg
+
+  def push(self, js: dict):
+    if self.open:
+      self._incoming.put_nowait(JSON.dumps(js))
+
+  def drop(self):
+    """Loses the connection, as when the server goes away."""
+    if self.open:
+      self.open = False
+      self._incoming.put_nowait(None)
+
+  async def close(self):
+    self.drop()
+
+  def cmds(self):
+    return [js['cmd'] for js in self.sent]
+
+
+class FakeGizwits:
+  """Accepts any login unless login_ok is False.
+
+  c2s_raw frames are answered with whatever respond(did, frame) returns;
+  the default answers position queries with the position in positions.
+  """
+
+  def __init__(self):
+    self.sockets = []
+    self.login_ok = True
+    # seconds each connect takes
+    self.connect_delay = 0
+    self.requests = []
+    # closed percentage by (did, channel)
+    self.positions = {}
+
+  async def connect(self, url, **kwargs):
+    await asyncio.sleep(self.connect_delay)
+    ws = FakeSocket(self)
+    self.sockets.append(ws)
+    return ws
+
+  def handle(self, ws: FakeSocket, js: dict):
+    cmd = js['cmd']
+    if cmd == 'login_req':
+      return [{'cmd': 'login_res', 'data': {'success': self.login_ok}}]
+    elif cmd == 'ping':
+      return [{'cmd': 'pong'}]
+    elif cmd == 'c2s_raw':
+      did = js['data']['did']
+      frame = decode_request(bytes(js['data']['raw']))
+      self.requests.append((did, frame))
+      return self.respond(did, frame)
+    return []
+
+  def respond(self, did: str, frame):
+    if frame.frame_type == FrameType.DEVICE_PARA_REQ:
+      channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+      pct = self.positions.get((did, channel))
+      if pct is not None:
+        return [para_resp(did, frame.seq_num, channel, pct)]
+    return []
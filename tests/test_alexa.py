@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('google.cloud.datastore')
+
+from conftest import TOKEN
+from src.alexa import Alexa
+
+
+class StubApi:
+  """Answers every command with resp."""
+
+  def __init__(self, resp):
+    self._resp = resp
+    self.sent = []
+
+  def control_latest(self, giz_token, did, device_key, frame):
+    self.sent.append((did, device_key))
+    return self._resp
+
+
+def _directive(namespace, name, payload):
+  return {
+      'header': {
+          'namespace': namespace,
+          'name': name,
+          'correlationToken': 'correlation'
+      },
+      'endpoint': {
+          'scope': {
+              'type': 'BearerToken',
+              'token': 'bearer'
+          },
+          'endpointId': 'did#100001',
+          'cookie': {
+              'did': 'did',
+              'channelHex': '100001'
+          }
+      },
+      'payload': payload
+  }
+
+
+def _alexa(monkeypatch, resp):
+  monkeypatch.setattr(Alexa, '_giz_token_from_bearer',
+                      staticmethod(lambda bearer: TOKEN))
+  return Alexa(StubApi(resp))
+
+
+def test_set_percentage(monkeypatch):
+  alexa = _alexa(monkeypatch, {})
+  directive = _directive('Alexa.PercentageController', 'SetPercentage',
+                         {'percentage': 40})
+  event = json.loads(alexa._handle_pct(directive))['event']
+  assert event['header']['name'] == 'Response'
+  assert alexa._api.sent == [('did', 'did#100001')]
+
+
+@pytest.mark.parametrize('handle', [
+    lambda alexa: alexa._handle_pct(
+        _directive('Alexa.PercentageController', 'SetPercentage',
+                   {'percentage': 40})),
+    lambda alexa: alexa._handle_on_off(
+        _directive('Alexa.PowerController', 'TurnOn', {}), 'ON'),
+])
+def test_failed_command_is_an_error_response(monkeypatch, handle):
+  alexa = _alexa(monkeypatch, {'error_message': 'no acknowledgement from did'})
+  event = json.loads(handle(alexa))['event']
+  assert event['header']['name'] == 'ErrorResponse'
+  assert event['header']['correlationToken'] == 'correlation'
+  assert event['endpoint']['endpointId'] == 'did#100001'
+  assert event['payload'] == {
+      'type': 'ENDPOINT_UNREACHABLE',
+      'message': 'no acknowledgement from did'
+  }
@@ -0,0 +1,47 @@
+from src.cache import LRUCache
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+def test_evicts_least_recently_used():
+  cache = LRUCache(2)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  assert cache.get('a') == 1
+  cache.put('c', 3)
+  assert 'b' not in cache
+  assert cache.get('a') == 1 and cache.get('c') == 3
+  assert len(cache) == 2 and cache.evictions == 1
+
+
+def test_ttl():
+  clock = FakeClock()
+  cache = LRUCache(10, ttl=5, clock=clock)
+  cache.put('a', 1)
+  cache.put('b', 2, ttl=20)
+  cache.put('c', 3, ttl=None)
+  clock.now = 10
+  assert cache.get('a') is None
+  assert cache.get('b') == 2
+  clock.now = 1000
+  assert cache.get('b', 'gone') == 'gone'
+  assert cache.get('c') == 3
+  assert len(cache) == 1
+
+
+def test_pop_and_counters():
+  cache = LRUCache(10)
+  cache.put('a', 1)
+  assert cache.pop('a') == 1
+  assert cache.pop('a') is None
+  assert cache.get('a') is None
+  cache.put('a', None)
+  assert 'a' in cache
+  assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+pytest.importorskip('google.cloud.datastore')
+pytest.importorskip('websockets')
+
+from conftest import TOKEN
+from fake_datastore import FakeDatastoreClient
+from src import catalog
+from src.auth import datastore
+from src.catalog import CatalogCache, catalog_devices
+from src.discovery import Device, IncompleteDiscoveryError
+
+
+class FakeDiscovery:
+  """Discovers whatever devices holds; raises if it holds an exception."""
+  devices = []
+  calls = 0
+
+  def __init__(self, api, token):
+    pass
+
+  def discover(self):
+    FakeDiscovery.calls += 1
+    if isinstance(self.devices, Exception):
+      raise self.devices
+    return list(self.devices)
+
+
+@pytest.fixture(autouse=True)
+def fakes(monkeypatch):
+  monkeypatch.setattr(datastore, '_CLIENT', FakeDatastoreClient())
+  monkeypatch.setattr(catalog, 'DeviceDiscovery', FakeDiscovery)
+  FakeDiscovery.devices = [Device('did', b'\x10\x00\x01', 'Kitchen', None)]
+  FakeDiscovery.calls = 0
+
+
+def _names(c):
+  return [d.name for d in catalog_devices(c)]
+
+
+def test_invalidation_reaches_other_instances():
+  mine, other = CatalogCache(memory_ttl=0.05), CatalogCache(memory_ttl=0.05)
+  assert _names(mine.get(None, TOKEN)) == ['Kitchen']
+  assert _names(other.get(None, TOKEN)) == ['Kitchen']
+  assert FakeDiscovery.calls == 1
+
+  # the user logged in again, as another account
+  FakeDiscovery.devices = [Device('did2', b'\x10\x00\x01', 'Bedroom', None)]
+  mine.invalidate(TOKEN.username)
+  time.sleep(0.1)
+  assert _names(other.get(None, TOKEN)) == ['Bedroom']
+
+
+def test_catalog_is_served_without_discovery():
+  cache = CatalogCache()
+  cache.get(None, TOKEN)
+  FakeDiscovery.devices.append(Device('did', b'\x10\x01\x01', 'Hall', None))
+  gets = datastore._CLIENT.gets
+  assert _names(cache.get(None, TOKEN)) == ['Kitchen']
+  assert FakeDiscovery.calls == 1
+  assert datastore._CLIENT.gets == gets
+
+
+def test_expired_catalog_falls_back_to_the_stored_one():
+  cache = CatalogCache(ttl=60)
+  c = cache.get(None, TOKEN)
+  c.refreshed_at -= 120
+  FakeDiscovery.devices = OSError('gizwits is down')
+  assert _names(cache.get(None, TOKEN)) == ['Kitchen']
+  cache.invalidate(TOKEN.username)
+  with pytest.raises(OSError):
+    cache.get(None, TOKEN)
+
+
+def test_silent_hub_keeps_its_stored_devices():
+  cache = CatalogCache()
+  FakeDiscovery.devices.append(Device('hub2', b'\x10\x00\x01', 'Hall', None))
+  cache.get(None, TOKEN)
+
+  kitchen = Device('did', b'\x10\x00\x01', 'Kitchen2', None)
+  FakeDiscovery.devices = IncompleteDiscoveryError([kitchen], ['hub2'])
+  assert _names(cache.refresh(None, TOKEN)) == ['Kitchen2', 'Hall']
+
+
+def test_incomplete_catalog_is_not_stored():
+  cache = CatalogCache()
+  FakeDiscovery.devices = IncompleteDiscoveryError([], ['did'])
+  with pytest.raises(IncompleteDiscoveryError):
+    cache.get(None, TOKEN)
+  assert datastore.CatalogRepo.get_catalog(TOKEN.username) is None
+
+
+def test_endpoints_rendered_again_by_a_new_deploy(monkeypatch):
+  cache = CatalogCache()
+  c = cache.get(None, TOKEN)
+  assert cache.endpoints(c, 'alexa', lambda d: d.name) == '["Kitchen"]'
+  assert cache.endpoints(c, 'alexa', lambda d: 'stale') == '["Kitchen"]'
+
+  monkeypatch.setattr(catalog, '_RENDER_VERSION', 'next')
+  assert cache.endpoints(c, 'alexa', lambda d: d.did) == '["did"]'
+  assert list(c.endpoints) == ['alexa@next']
@@ -0,0 +1,71 @@
+import asyncio
+
+from src.coalescer import CommandCoalescer
+
+
+class RecordingApi:
+
+  def __init__(self):
+    self.sent = []
+
+  async def control(self, giz_token, did, frame):
+    self.sent.append((did, frame))
+    await asyncio.sleep(0.01)
+    return {'frame': frame}
+
+
+def _run(coro):
+  loop = asyncio.new_event_loop()
+  try:
+    result = loop.run_until_complete(coro)
+    # let the devices' queues wind down
+    loop.run_until_complete(asyncio.sleep(0.05))
+    return result
+  finally:
+    loop.close()
+
+
+def test_burst_sends_only_latest():
+  api = RecordingApi()
+  coalescer = CommandCoalescer(api, window=0.01)
+
+  async def _burst():
+    return await asyncio.gather(
+        *[coalescer.submit('token', 'did', 'did#01', pct) for pct in range(5)],
+        coalescer.submit('token', 'did', 'did#02', 50))
+
+  results = _run(_burst())
+  assert sorted(api.sent) == [('did', 4), ('did', 50)]
+  assert results == [{'frame': 4}] * 5 + [{'frame': 50}]
+  assert coalescer.metrics() == {'submitted': 6, 'coalesced': 4, 'sent': 2}
+
+
+def test_commands_during_send_follow_in_order():
+  api = RecordingApi()
+  coalescer = CommandCoalescer(api, window=0.01)
+
+  async def _sequence():
+    first = asyncio.ensure_future(coalescer.submit('t', 'did', 'did#01', 1))
+    await asyncio.sleep(0.005)  # first is being sent
+    later = [coalescer.submit('t', 'did', 'did#01', pct) for pct in (2, 3)]
+    return await asyncio.gather(first, *later)
+
+  results = _run(_sequence())
+  assert api.sent == [('did', 1), ('did', 3)]
+  assert results == [{'frame': 1}, {'frame': 3}, {'frame': 3}]
+
+
+def test_command_to_idle_device_is_sent_at_once():
+  api = RecordingApi()
+  coalescer = CommandCoalescer(api, window=0.5)
+
+  async def _single():
+    start = asyncio.get_event_loop().time()
+    await coalescer.submit('t', 'did', 'did#01', 1)
+    elapsed = asyncio.get_event_loop().time() - start
+    # let the device's queue wind down
+    await asyncio.sleep(0.6)
+    return elapsed
+
+  assert _run(_single()) < 0.25
+  assert api.sent == [('did', 1)]
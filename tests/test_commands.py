@@ -0,0 +1,22 @@
+from src import commands
+from src.frame_constants import DataKeys
+from src.frames import DEFAULT_DECODER, DEFAULT_ENCODER, Header
+
+
+def test_set_closed_pcts_single_matches_set_closed_pct():
+  channel = b'\x10\x02\x01'
+  assert (DEFAULT_ENCODER.encode(commands.set_closed_pcts([(channel, 40)]), 7)
+          == DEFAULT_ENCODER.encode(commands.set_closed_pct(channel, 40), 7))
+
+
+def test_set_closed_pcts_encodes_every_channel():
+  targets = [(bytes([0x10, i, 0x01]), 10 * i) for i in range(5)]
+  frame = commands.set_closed_pcts(targets)
+  # the decoder only reads action bytes of cmd 145 frames
+  frame.header = Header(0, 145, 6)
+  raw = DEFAULT_ENCODER.encode(frame, 9)
+  frame = DEFAULT_DECODER.decode_lazy(raw)
+  assert frame.seq_num == 9
+  assert frame.get_all(DataKeys.DEVICE_ADDR_CHANNEL) == [c for c, _ in targets]
+  assert [d[1] for d in frame.get_all(DataKeys.DEVICE_CMD_DATA)
+         ] == [p for _, p in targets]
@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from conftest import TOKEN, run
+from fake_gizwits import para_resp, status_resp
+from src.connection import ConnectionPool, GizConnectionError
+from src.frame_constants import DataKeys
+from src.frames import CommandFrame, FrameData, FrameType, Header
+from src.gizapi import GizToken
+
+_CHANNELS = [bytes([0x10, i, 0x01]) for i in range(5)]
+
+
+def _para_req(channel: bytes):
+  return CommandFrame(
+      Header(0, 144, 5),
+      FrameType.DEVICE_PARA_REQ,
+      data=[FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel)])
+
+
+async def _with_pool(fn, **kwargs):
+  pool = ConnectionPool(url='wss://gizwits.invalid', appid='app', **kwargs)
+  try:
+    return await fn(pool)
+  finally:
+    await pool.close()
+
+
+def test_pipelined_replies_are_matched_by_seq(server):
+  held = []
+
+  def _respond(did, frame):
+    # answer only once every query is in flight, last one first
+    channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    held.append(para_resp(did, frame.seq_num, channel, channel[1] * 10))
+    return list(reversed(held)) if len(held) == len(_CHANNELS) else []
+
+  server.respond = _respond
+
+  async def _query_all(conn):
+    return await asyncio.gather(*[
+        conn.request('did', _para_req(c), FrameType.DEVICE_PARA_RESP, 5)
+        for c in _CHANNELS
+    ])
+
+  replies = run(_with_pool(lambda pool: pool.run(TOKEN, _query_all)))
+  assert [r.get(DataKeys.DEVICE_ADDR_CHANNEL) for r in replies] == _CHANNELS
+  assert [r.get(DataKeys.INNER_PARA_DATA)[0] for r in replies
+         ] == [10 * i for i in range(5)]
+  assert len(server.sockets) == 1
+  assert server.sockets[0].cmds() == ['login_req'] + ['c2s_raw'] * 5
+
+
+def test_unsolicited_messages_go_to_subscriptions(server):
+
+  async def _receive(conn):
+    sub = conn.subscribe()
+    ws = server.sockets[0]
+    ws.push({'cmd': 'pong'})
+    ws.push(status_resp('did', _CHANNELS[0], 30))
+    ws.push({'cmd': 's2c_online_status', 'data': {'did': 'did'}})
+    first = await asyncio.wait_for(sub.get(), 5)
+    second = await asyncio.wait_for(sub.get(), 5)
+    sub.close()
+    return first, second
+
+  pushed = run(_with_pool(lambda pool: pool.run(TOKEN, _receive)))
+  assert pushed[0][0] == 'did'
+  assert pushed[0][1].frame_type == FrameType.DEVICE_STATUS_RESP
+  assert pushed[1][0] is None
+  assert pushed[1][1]['cmd'] == 's2c_online_status'
+
+
+def test_full_subscription_drops_oldest(server):
+
+  async def _overflow(conn):
+    sub = conn.subscribe(2)
+    for pct in (10, 20, 30):
+      server.sockets[0].push(status_resp('did', _CHANNELS[0], pct))
+    await asyncio.sleep(0.01)
+    _, frame = await sub.get()
+    return sub.dropped, frame.get(DataKeys.DEVICE_CMD_DATA)[1]
+
+  assert run(_with_pool(lambda pool: pool.run(TOKEN, _overflow))) == (1, 20)
+
+
+def test_login_failure_closes_the_socket(server):
+  server.login_ok = False
+
+  async def _never(conn):
+    raise AssertionError('ran without a login')
+
+  with pytest.raises(GizConnectionError):
+    run(_with_pool(lambda pool: pool.run(TOKEN, _never)))
+  assert not server.sockets[0].open
+
+
+def test_lost_socket_fails_requests_and_subscriptions(server):
+
+  async def _lose(conn):
+    sub = conn.subscribe()
+    request = conn.request('did', _para_req(_CHANNELS[0]),
+                           FrameType.DEVICE_PARA_RESP)
+    asyncio.get_event_loop().call_later(0.01, server.sockets[0].drop)
+    return await asyncio.wait_for(
+        asyncio.gather(request, sub.get(), return_exceptions=True), 5)
+
+  results = run(_with_pool(lambda pool: pool.run(TOKEN, _lose)))
+  assert [type(r) for r in results] == [websockets.ConnectionClosed] * 2
+  assert len(server.sockets) == 1
+
+
+def test_run_retries_once_on_a_fresh_socket(server):
+  server.positions[('did', _CHANNELS[0])] = 40
+  calls = []
+
+  async def _query(conn):
+    calls.append(conn)
+    if len(calls) == 1:
+      server.sockets[0].drop()
+      await asyncio.sleep(0.01)
+    return await conn.request('did', _para_req(_CHANNELS[0]),
+                              FrameType.DEVICE_PARA_RESP, 5)
+
+  frame = run(_with_pool(lambda pool: pool.run(TOKEN, _query)))
+  assert frame.get(DataKeys.INNER_PARA_DATA)[0] == 40
+  assert len(calls) == 2
+  assert server.sockets[0].cmds() == ['login_req']
+  assert server.sockets[1].cmds() == ['login_req', 'c2s_raw']
+
+
+def test_new_token_logs_in_again_on_the_same_socket(server):
+  refreshed = GizToken('token2', 'uid', TOKEN.expire_at, 'user', 'pw')
+
+  async def _noop(conn):
+    pass
+
+  async def _both(pool):
+    await pool.run(TOKEN, _noop)
+    await pool.run(refreshed, _noop)
+
+  run(_with_pool(_both))
+  assert len(server.sockets) == 1
+  logins = [js['data']['token'] for js in server.sockets[0].sent]
+  assert logins == ['token', 'token2']
+
+
+def test_overflow_closes_least_recently_used(server):
+
+  async def _noop(conn):
+    pass
+
+  async def _three_users(pool):
+    for uid in ('a', 'b', 'c'):
+      await pool.run(GizToken('t', uid, TOKEN.expire_at, uid, 'pw'), _noop)
+
+    return len(pool), [ws.open for ws in server.sockets]
+
+  assert run(_with_pool(_three_users, max_size=2)) == (2, [False, True, True])
+
+
+def test_connections_in_use_get_heartbeats(server):
+
+  async def _hold(conn):
+    await asyncio.sleep(1)
+
+  async def _noop(conn):
+    pass
+
+  async def _hold_then_reuse(pool):
+    await pool.run(TOKEN, _hold)
+    await pool.run(TOKEN, _noop)
+
+  run(_with_pool(_hold_then_reuse, heartbeat_interval=0.4))
+  assert len(server.sockets) == 1
+  assert server.sockets[0].cmds().count('ping') >= 3
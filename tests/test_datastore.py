@@ -0,0 +1,113 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('google.cloud.datastore')
+
+from fake_datastore import FakeDatastoreClient
+from src.auth import datastore
+from src.auth.datastore import AuthCodeRepo, TokenRepo
+from src.auth.models import OAuth2AuthorizationCode
+from src.cache import LRUCache
+
+_REQUEST = SimpleNamespace(user=SimpleNamespace(username='user'))
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def clock():
+  return FakeClock()
+
+
+@pytest.fixture
+def client(monkeypatch, clock):
+  client = FakeDatastoreClient()
+  monkeypatch.setattr(datastore, '_CLIENT', client)
+  # the repos' caches are shared by the class, start each test empty
+  monkeypatch.setattr(TokenRepo, '_CACHE', LRUCache(10, ttl=3600, clock=clock))
+  monkeypatch.setattr(TokenRepo, '_MISSING', LRUCache(10, ttl=30, clock=clock))
+  monkeypatch.setattr(AuthCodeRepo, '_MISSING',
+                      LRUCache(10, ttl=30, clock=clock))
+  return client
+
+
+def _put_token(access_token, expires_in=86400):
+  token = {
+      'token_type': 'Bearer',
+      'access_token': access_token,
+      'refresh_token': 'refresh-' + access_token,
+      'scope': 'profile',
+      'expires_in': expires_in
+  }
+  TokenRepo.put_token(token, _REQUEST)
+
+
+def _auth_code(code):
+  return OAuth2AuthorizationCode(code, 'client', 'https://example.com/cb',
+                                 'code', 'profile', int(time.time()), 'user')
+
+
+def test_token_is_cached_until_it_expires(client, clock):
+  _put_token('short', expires_in=10)
+  _put_token('long')
+  assert TokenRepo.get_token('short').user_id == 'user'
+  assert TokenRepo.get_token('long').user_id == 'user'
+  assert client.gets == 2
+
+  clock.now = 20
+  assert TokenRepo.get_token('long') is not None
+  assert client.gets == 2
+  # the cached copy outlived the token, so it's looked up again
+  TokenRepo.get_token('short')
+  assert client.gets == 3
+
+
+def test_deleted_token_is_evicted(client):
+  _put_token('token')
+  assert TokenRepo.get_token('token') is not None
+  TokenRepo.del_token('token')
+  assert TokenRepo.get_token('token') is None
+  assert client.gets == 1
+
+
+def test_unknown_token_is_looked_up_once(client, clock):
+  assert TokenRepo.get_token('unknown') is None
+  assert TokenRepo.get_token('unknown') is None
+  assert TokenRepo.get_token_by_refresh_token('unknown') is None
+  assert TokenRepo.get_token_by_refresh_token('unknown') is None
+  assert client.gets == 2
+  assert TokenRepo.cache_metrics()['negative_hits'] == 2
+
+  clock.now = 60
+  assert TokenRepo.get_token('unknown') is None
+  assert client.gets == 3
+
+
+def test_put_token_clears_negative_entries(client):
+  assert TokenRepo.get_token('token') is None
+  assert TokenRepo.get_token_by_refresh_token('refresh-token') is None
+  _put_token('token')
+  assert TokenRepo.get_token('token').access_token == 'token'
+  assert TokenRepo.get_token_by_refresh_token(
+      'refresh-token').access_token == 'token'
+
+
+def test_put_auth_code_clears_negative_entries(client):
+  assert AuthCodeRepo.get_auth_code('code') is None
+  assert AuthCodeRepo.get_auth_code('code') is None
+  assert client.gets == 1
+  AuthCodeRepo.put_auth_code(_auth_code('code'))
+  assert AuthCodeRepo.get_auth_code('code').user_id == 'user'
+
+  AuthCodeRepo.del_auth_code('code')
+  assert AuthCodeRepo.get_auth_code('code') is None
+  assert client.gets == 2
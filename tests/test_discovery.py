@@ -0,0 +1,130 @@
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from conftest import TOKEN, run
+from fake_gizwits import para_resp, s2c_raw
+from src.connection import ConnectionPool
+from src.discovery import Device, DeviceDiscovery, IncompleteDiscoveryError
+from src.frame_constants import DataKeys
+from src.frames import FrameData, FrameType
+from src.gizapi import Binding
+from src.runtime import RUNTIME
+from src.state import StateCache
+
+
+class StubApi:
+
+  def __init__(self, dids=()):
+    self._dids = dids
+
+  def check_token(self, token):
+    return token
+
+  def list_bindings(self, token):
+    return [Binding(did) for did in self._dids]
+
+
+class StubSubscriber:
+
+  def watch(self, token):
+    pass
+
+  def watching(self, token):
+    return False
+
+
+def _discovery(pool, dids=()):
+  return DeviceDiscovery(
+      StubApi(dids),
+      TOKEN,
+      pool=pool,
+      states=StateCache(),
+      subscriber=StubSubscriber())
+
+
+@pytest.fixture
+def pool():
+  pool = ConnectionPool(url='wss://gizwits.invalid', appid='app')
+  yield pool
+  RUNTIME.run(pool.close())
+
+
+def test_devices_listed_from_all_hubs_at_once(server):
+  listed = []
+
+  def _respond(did, frame):
+    listed.append((did, frame.seq_num))
+    if len(listed) < 3:
+      return []
+    # every hub was asked before any answered
+    return [
+        s2c_raw(d, FrameType.DEVICE_LIST_RESP, seq,
+                FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, b'\x10\x00\x01'))
+        for d, seq in listed
+        if d != 'silent'
+    ]
+
+  server.respond = _respond
+
+  async def _discover():
+    pool = ConnectionPool(url='wss://gizwits.invalid', appid='app')
+    try:
+      return await _discovery(pool)._discover(TOKEN, ['hub1', 'silent', 'hub2'],
+                                              0.1)
+    finally:
+      await pool.close()
+
+  devices = run(_discover())
+  assert sorted(did for did, _ in listed) == ['hub1', 'hub2', 'silent']
+  assert [did for did, _ in devices] == ['hub1', 'hub2']
+  assert devices[0][1].frame_type == FrameType.DEVICE_LIST_RESP
+
+
+def _list_resp(did, seq):
+  return s2c_raw(did, FrameType.DEVICE_LIST_RESP, seq,
+                 FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, b'\x10\x00\x01'),
+                 FrameData(DataKeys.NAME.value, 'Kitchen'),
+                 FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, 30, 0])))
+
+
+def test_discovery_deadline_starts_after_login(server, pool):
+  server.connect_delay = 1
+  server.respond = lambda did, frame: [_list_resp(did, frame.seq_num)]
+  device, = _discovery(pool, ['hub']).discover(timeout=0.9)
+  assert (device.did, device.name, device.closed_pct) == ('hub', 'Kitchen', 30)
+
+
+def test_discovery_with_a_silent_hub_is_incomplete(server, pool):
+  server.respond = lambda did, frame: ([_list_resp(did, frame.seq_num)]
+                                       if did == 'hub' else [])
+  with pytest.raises(IncompleteDiscoveryError) as e:
+    _discovery(pool, ['hub', 'silent']).discover(timeout=0.2)
+  assert [d.did for d in e.value.devices] == ['hub']
+  assert e.value.missing == ['silent']
+
+
+def test_query_positions_rejects_replies_for_other_channels(server, pool):
+  good = Device('did', b'\x10\x00\x01', None, None)
+  other = Device('did', b'\x10\x01\x01', None, None)
+
+  def _respond(did, frame):
+    # a reply matching the seq num of a query for another channel
+    channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    if channel == other.channel:
+      channel = b'\x10\x07\x01'
+    return [para_resp(did, frame.seq_num, channel, 40)]
+
+  server.respond = _respond
+  result = _discovery(pool).query_positions([good, other], timeout=1)
+  assert result.positions == {good.id: 40}
+  assert list(result.errors) == [other.id]
+
+
+def test_query_positions_reports_connection_failures(server, pool):
+  server.login_ok = False
+  devices = [Device('did', bytes([0x10, i, 0x01]), None, None) for i in (0, 1)]
+  result = _discovery(pool).query_positions(devices, timeout=1)
+  assert result.positions == {}
+  assert sorted(result.errors) == sorted(d.id for d in devices)
+  assert 'login failed' in result.errors[devices[0].id]
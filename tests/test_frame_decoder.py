@@ -0,0 +1,125 @@
+import pytest
+from src.frame_constants import DataKey, DataKeys, DataKeyType
+from src.frames import (CommandFrame, FrameData, FrameDecoder, FrameEncoder,
+                        FrameStreamDecoder, FrameType, Header)
+
+
+def _device_list_resp(n, unknown=False):
+  data = []
+  for i in range(n):
+    data += [
+        FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, bytes([0x10, i, 1])),
+        FrameData(DataKeys.NAME.value, 'blind %d' % i),
+        FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, i, 0])),
+        FrameData(DataKeys.DEVICE_TYPE.value, 0x0102),
+    ]
+    if unknown:
+      data.append(FrameData(DataKey(999, 'UNKNOWN', DataKeyType.BYTES), b'?'))
+  frame = CommandFrame(
+      header=Header(0, 145, 6),
+      frame_type=FrameType.DEVICE_LIST_RESP,
+      data=data)
+  return FrameEncoder().encode(frame)
+
+
+def test_lazy_decode_matches_decode():
+  raw = _device_list_resp(40)
+  dec = FrameDecoder()
+  eager = dec.decode(raw)
+  lazy = dec.decode_lazy(raw)
+  assert lazy.header == eager.header
+  assert lazy.frame_type == eager.frame_type == FrameType.DEVICE_LIST_RESP
+  assert lazy.seq_num == eager.seq_num
+  assert lazy.data == eager.data
+
+
+def test_all_keys_round_trip():
+  values = {
+      DataKeyType.STRING: 'h\u00e9llo',
+      DataKeyType.BYTE: 0xAB,
+      DataKeyType.BYTES: bytes([1, 2, 3, 4]),
+      DataKeyType.UINT8: 7,
+      DataKeyType.UINT16: 0xBEEF,
+      DataKeyType.UINT32: 0xDEADBEEF,
+  }
+  data = [FrameData(k.value, values[k.value.key_type]) for k in DataKeys]
+  frame = CommandFrame(
+      header=Header(0, 145, 6), frame_type=FrameType.DEVICE_STATUS_RESP,
+      data=data)
+  decoded = FrameDecoder().decode(FrameEncoder().encode(frame))
+  assert decoded.data == data
+
+
+def test_lazy_decode_get():
+  lazy = FrameDecoder().decode_lazy(_device_list_resp(3, unknown=True))
+  assert DataKeys.NAME in lazy
+  assert DataKeys.INNER_PARA_DATA not in lazy
+  assert lazy.get(DataKeys.NAME) == 'blind 0'
+  assert lazy.get(DataKeys.INNER_PARA_DATA, 7) == 7
+  assert lazy.get_all(DataKeys.NAME) == ['blind 0', 'blind 1', 'blind 2']
+  assert lazy.get_all(DataKeys.DEVICE_ADDR_CHANNEL.value) == [
+      bytes([0x10, i, 1]) for i in range(3)
+  ]
+  assert lazy.get_all(DataKeys.DEVICE_TYPE.value.key_id) == [0x0102] * 3
+  assert lazy.get_all(DataKeys.ROOM_ID) == []
+
+
+def test_stream_decoder_chunks():
+  frames = [_device_list_resp(n) for n in (1, 40, 0, 3)]
+  stream = b''.join(frames)
+  dec = FrameDecoder()
+  expected = [dec.decode(f).data for f in frames]
+  for chunk_size in (1, 7, 64, len(stream)):
+    for lazy in (False, True):
+      sd = FrameStreamDecoder(lazy=lazy)
+      got = []
+      for i in range(0, len(stream), chunk_size):
+        sd.feed(stream[i:i + chunk_size])
+        got += [f.data for f in sd]
+      assert got == expected
+      assert len(sd) == 0
+
+
+def test_stream_decoder_keeps_partial_frame():
+  frame = _device_list_resp(2)
+  sd = FrameStreamDecoder()
+  sd.feed(frame + frame[:10])
+  assert len(list(sd)) == 1
+  assert sd.next_frame() is None
+  sd.feed(frame[10:])
+  assert sd.next_frame().frame_type == FrameType.DEVICE_LIST_RESP
+
+
+def test_stream_decoder_skips_bad_frame():
+  frame = _device_list_resp(2)
+  bad = bytearray(frame)
+  bad[9] = 0  # the start of the frame marker
+  sd = FrameStreamDecoder()
+  sd.feed(bytes(bad))
+  with pytest.raises(ValueError) as e:
+    sd.next_frame()
+  # e's traceback still holds the failed decode
+  sd.feed(frame)
+  assert 'invalid message' in str(e.value)
+  assert sd.next_frame().frame_type == FrameType.DEVICE_LIST_RESP
+  assert len(sd) == 0
+
+
+def test_decoded_frame_index():
+  frame = FrameDecoder().decode(_device_list_resp(3))
+  assert not hasattr(frame, '__dict__')
+  assert not hasattr(frame.data[0], '__dict__')
+  assert DataKeys.NAME in frame
+  assert frame.get(DataKeys.NAME) == 'blind 0'
+  assert frame.get_all(DataKeys.NAME) == ['blind 0', 'blind 1', 'blind 2']
+  assert frame.get_all(DataKeys.ROOM_ID) == []
+
+
+def test_built_frame_index():
+  frame = CommandFrame(header=Header(0, 144, 5), frame_type=0)
+  assert frame.get(DataKeys.NAME) is None
+  frame.data = [
+      FrameData(DataKeys.NAME.value, 'a'),
+      FrameData(DataKeys.NAME.value, 'b')
+  ]
+  assert frame.get_all(DataKeys.NAME.value) == ['a', 'b']
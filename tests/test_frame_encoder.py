@@ -1,4 +1,115 @@
-from src.frames import CommandFrame, FrameData, FrameEncoder, FrameType
+import threading
 
-def test_foo():
-  pass
\ No newline at end of file
+import pytest
+
+from src import commands
+from src.frame_constants import DataKey, DataKeys
+from src.frames import (CommandFrame, FastFrameEncoder, FrameData, FrameEncoder,
+                        FrameTemplate, FrameType, Header, MotoCmd,
+                        SequenceAllocator, SequenceAllocators, Slot)
+
+
+def _execute_frame(channel=bytes([1, 2, 3]), pct=40):
+  return CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_EXECUTE_REQ,
+      data=[
+          FrameData(DataKeys.DEVICE_CMD.value,
+                    MotoCmd.PERCENT_RUNING_LIGHT_DIMMER.value),
+          FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, channel),
+          FrameData(DataKeys.DEVICE_CMD_DATA.value, bytes([1, pct, 0]))
+      ])
+
+
+def test_fast_encoder_matches_encoder():
+  frames = [
+      CommandFrame(
+          header=Header(0, 144, 5), frame_type=FrameType.DEVICE_LIST_REQ),
+      CommandFrame(header=Header(0, 145, None), frame_type=0x1234),
+      _execute_frame(),
+      CommandFrame(
+          header=Header(0, 144, 5),
+          frame_type=FrameType.DEVICE_PARA_REQ,
+          data=[
+              FrameData(DataKeys.NAME.value, 'living room'),
+              FrameData(DataKeys.HOST_PORT.value, 8080),
+              FrameData(DataKeys.TIMER_LOOP_MARK.value, 0x01020304),
+          ]),
+      # large enough that the total length needs a two byte varint
+      _execute_frame(channel=bytes(range(200))),
+  ]
+  enc = FrameEncoder()
+  fast = FastFrameEncoder()
+  for _ in range(3):
+    for f in frames:
+      assert fast.encode(f) == enc.encode(f)
+
+
+def test_fast_encoder_rejects_unknown_type():
+  frame = CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_PARA_REQ,
+      data=[FrameData(DataKey(999, 'UNKNOWN', None), b'?')])
+  with pytest.raises(ValueError):
+    FastFrameEncoder().encode(frame)
+
+
+def test_template_matches_encoder():
+  enc = FrameEncoder()
+  fast = FastFrameEncoder()
+  for channel in (bytes([1, 2, 3]), bytes([4, 5]), bytes([1, 2, 3])):
+    for pct in (0, 40, 100):
+      expected = enc.encode(_execute_frame(channel=channel, pct=pct))
+      assert fast.encode(commands.set_closed_pct(channel, pct)) == expected
+
+  frame = CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_EXECUTE_REQ,
+      data=[
+          FrameData(DataKeys.DEVICE_CMD.value, MotoCmd.UP.value),
+          FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, bytes([9, 9, 9]))
+      ])
+  assert fast.encode(commands.moto_cmd(bytes([9, 9, 9]), MotoCmd.UP)) == \
+      enc.encode(frame)
+
+
+def test_template_string_and_seq_wrap():
+  shape = CommandFrame(
+      header=Header(0, 144, 5),
+      frame_type=FrameType.DEVICE_PARA_REQ,
+      data=[
+          FrameData(DataKeys.NAME.value, Slot('name')),
+          FrameData(DataKeys.HOST_PORT.value, Slot('port')),
+      ])
+  template = FrameTemplate(shape)
+  enc = FrameEncoder()
+  for seq, name in ((0xFFFE, 'den'), (0xFFFF, 'living room'), (0, 'café')):
+    frame = CommandFrame(
+        header=shape.header,
+        frame_type=shape.frame_type,
+        data=[
+            FrameData(DataKeys.NAME.value, name),
+            FrameData(DataKeys.HOST_PORT.value, 443)
+        ])
+    expected = enc.encode(frame, seq)
+    assert template.render(seq, {'name': name, 'port': 443}) == expected
+
+
+def test_sequence_allocator_threads():
+  alloc = SequenceAllocator(start=0)
+  seen = []
+
+  def _run():
+    seen.extend(alloc.next() for _ in range(5000))
+
+  threads = [threading.Thread(target=_run) for _ in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert sorted(seen) == list(range(40000))
+
+
+def test_sequence_allocators_per_key():
+  allocs = SequenceAllocators()
+  assert [allocs.next('a'), allocs.next('a'), allocs.next('b')] == [4, 5, 4]
@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import test_utils, web
+from src import commands
+from src.frames import DEFAULT_ENCODER, SequenceAllocators
+from src.gizapi import AsyncGizApi, Binding, GizApi, GizAuthError, GizToken
+from src.js import JSON
+from src.runtime import RUNTIME
+
+
+@pytest.fixture(autouse=True)
+def no_hooks(monkeypatch):
+  # importing src.auth.oauth2 registers one that stores tokens in Datastore
+  monkeypatch.setattr(AsyncGizApi, '_TOKEN_UPDATE_HOOKS', [])
+
+
+class CountingApi(AsyncGizApi):
+
+  def __init__(self, refused_password=None):
+    super(CountingApi, self).__init__(root='http://gizwits.invalid/')
+    self.logins = 0
+    self._refused_password = refused_password
+
+  async def login(self, username, password):
+    self.logins += 1
+    await asyncio.sleep(0.01)
+    if password == self._refused_password:
+      raise GizAuthError('wrong password')
+    return GizToken('fresh%d' % self.logins, 'uid',
+                    int(time.time()) + 7 * 86400, username, password)
+
+
+def test_concurrent_refreshes_share_one_login():
+  api = CountingApi()
+  stored = []
+  AsyncGizApi.register_hook(stored.append)
+  expired = GizToken('old', 'uid', 0, 'user', 'pw')
+
+  async def _check_all():
+    return await asyncio.gather(*[api.check_token(expired) for _ in range(10)])
+
+  loop = asyncio.new_event_loop()
+  try:
+    tokens = loop.run_until_complete(_check_all())
+    # a caller still holding the expired token gets the refreshed one
+    again = loop.run_until_complete(api.check_token(expired))
+    loop.run_until_complete(api.close())
+  finally:
+    AsyncGizApi._TOKEN_UPDATE_HOOKS.remove(stored.append)
+    loop.close()
+
+  assert api.logins == 1
+  assert {t.token for t in tokens} == {'fresh1'}
+  assert again.token == 'fresh1'
+  assert [t.token for t in stored] == ['fresh1']
+
+
+def test_refresher_renews_tokens_about_to_expire():
+  api = CountingApi()
+  now = int(time.time())
+  soon = GizToken('soon', 'uid1', now + 60, 'soon-user', 'pw')
+  later = GizToken('later', 'uid2', now + 10 * 86400, 'later-user', 'pw')
+
+  async def _run():
+    await api.check_token(soon)
+    await api.check_token(later)
+    await api.refresher.refresh_due()
+    # stale copies of the old token don't trigger another refresh
+    await api.check_token(soon)
+    await api.refresher.refresh_due()
+    await api.close()
+
+  loop = asyncio.new_event_loop()
+  try:
+    loop.run_until_complete(_run())
+  finally:
+    loop.close()
+
+  assert api.logins == 1
+  assert len(api.refresher) == 2
+
+
+def test_refresher_stops_after_a_refused_login():
+  api = CountingApi(refused_password='old-pw')
+  soon = GizToken('soon', 'uid', int(time.time()) + 60, 'user', 'old-pw')
+
+  async def _run():
+    await api.check_token(soon)
+    for _ in range(5):
+      await api.refresher.refresh_due()
+    tracked_after_refusal = len(api.refresher)
+    # requests still carrying the token don't bring the user back
+    await api.check_token(soon)
+    tracked_with_old_password = len(api.refresher)
+    soon.password = 'new-pw'
+    await api.check_token(soon)
+    await api.close()
+    return (tracked_after_refusal, tracked_with_old_password,
+            len(api.refresher))
+
+  loop = asyncio.new_event_loop()
+  try:
+    assert loop.run_until_complete(_run()) == (0, 0, 1)
+  finally:
+    loop.close()
+  assert api.logins == 1
+
+
+class FakeGizwitsHttp:
+  """The Gizwits app API, answering as text/html like the real one does."""
+
+  def __init__(self):
+    self.requests = []
+    app = web.Application()
+    app.router.add_post('/app/login', self._login)
+    app.router.add_get('/app/bindings', self._bindings)
+    app.router.add_post('/app/control/{did}', self._control)
+    self.server = test_utils.TestServer(app)
+
+  @property
+  def root(self):
+    return str(self.server.make_url('/app/'))
+
+  async def _record(self, request):
+    body = await request.text()
+    self.requests.append((request.method, request.path, request.headers,
+                          JSON.loads(body) if body else None))
+    return self.requests[-1][3]
+
+  @staticmethod
+  def _reply(js):
+    return web.Response(text=JSON.dumps(js), content_type='text/html')
+
+  async def _login(self, request):
+    body = await self._record(request)
+    if body['password'] != 'pw':
+      return self._reply({'error_message': 'password error', 'error_code': 9})
+    return self._reply({
+        'token': 'token',
+        'uid': 'uid',
+        'expire_at': int(time.time()) + 86400
+    })
+
+  async def _bindings(self, request):
+    await self._record(request)
+    return self._reply({'devices': [{'did': 'hub1'}, {'did': 'hub2'}]})
+
+  async def _control(self, request):
+    await self._record(request)
+    return self._reply({})
+
+
+@pytest.fixture
+def http():
+  server = FakeGizwitsHttp()
+  RUNTIME.run(server.server.start_server())
+  api = GizApi(root=server.root, appid='app')
+  yield server, api
+  RUNTIME.run(api.aio.close())
+  RUNTIME.run(server.server.close())
+
+
+def test_login_over_http(http):
+  server, api = http
+  token = api.login('user', 'pw')
+  assert token == GizToken('token', 'uid', token.expire_at, 'user', 'pw')
+  method, path, headers, body = server.requests[0]
+  assert (method, path) == ('POST', '/app/login')
+  assert headers['X-Gizwits-Application-Id'] == 'app'
+  assert headers['Content-Type'] == 'application/json'
+  assert 'X-Gizwits-User-token' not in headers
+  assert body == {'username': 'user', 'password': 'pw'}
+
+
+def test_refused_login_over_http(http):
+  server, api = http
+  with pytest.raises(GizAuthError, match='password error'):
+    api.login('user', 'wrong')
+
+
+def test_bindings_and_control_over_http(http):
+  server, api = http
+  token = GizToken('token', 'uid', int(time.time()) + 86400, 'user', 'pw')
+  assert api.list_bindings(token) == [Binding('hub1'), Binding('hub2')]
+  frame = commands.set_closed_pct(b'\x10\x00\x01', 40)
+  assert api.control(token, 'hub1', frame) == {}
+
+  paths = [(method, path) for method, path, _, _ in server.requests]
+  assert paths == [('GET', '/app/bindings'), ('POST', '/app/control/hub1')]
+  for _, _, headers, _ in server.requests:
+    assert headers['X-Gizwits-Application-Id'] == 'app'
+    assert headers['X-Gizwits-User-token'] == 'token'
+  # the first frame to hub1 gets the allocator's first seq num
+  raw = DEFAULT_ENCODER.encode(frame, SequenceAllocators().next('hub1'))
+  assert server.requests[1][3] == {'raw': list(raw)}
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('google.cloud.datastore')
+
+from conftest import TOKEN
+from src import googlehome
+from src.coalescer import CommandCoalescer
+from src.gizapi import AsyncGizApi, GizApi
+from src.googlehome import GoogleHome
+
+
+class RecordingApi(AsyncGizApi):
+  """Records (did, closed pct) for each command; fails or hangs by did."""
+
+  def __init__(self, failing=(), hanging=()):
+    super(RecordingApi, self).__init__(root='http://gizwits.invalid/')
+    self.coalescer = CommandCoalescer(self, window=0)
+    self.sent = []
+    self._failing = failing
+    self._hanging = hanging
+
+  async def control(self, giz_token, did, frame):
+    if did in self._hanging:
+      await asyncio.sleep(10)
+    await asyncio.sleep(0.01)
+    self.sent.append((did, frame.values['cmd_data'][1]))
+    if did in self._failing:
+      return {'error_message': 'device offline', 'error_code': 9042}
+    return {}
+
+
+def _device(did):
+  return {
+      'id': did + '#100001',
+      'customData': {
+          'did': did,
+          'channelHex': '100001'
+      }
+  }
+
+
+def _execute(aio, commands):
+  payload = {
+      'commands': [{
+          'devices': [_device(did) for did in dids],
+          'execution': [{
+              'command': 'action.devices.commands.OpenClose',
+              'params': {
+                  'openPercent': pct
+              }
+          }]
+      } for dids, pct in commands]
+  }
+  home = GoogleHome(GizApi(aio=aio))
+  resp = json.loads(home._handle_execute('req', payload, TOKEN))
+  return resp['payload']['commands']
+
+
+def test_each_device_gets_its_own_status():
+  aio = RecordingApi(failing=('b',))
+  results = _execute(aio, [(['a', 'b', 'c'], 30), (['a'], 70)])
+  assert results == [{
+      'ids': ['a#100001'],
+      'status': 'SUCCESS',
+      'states': {
+          'openPercent': 70,
+          'online': True
+      }
+  }, {
+      'ids': ['b#100001'],
+      'status': 'ERROR',
+      'errorCode': 'transientError'
+  }, {
+      'ids': ['c#100001'],
+      'status': 'SUCCESS',
+      'states': {
+          'openPercent': 30,
+          'online': True
+      }
+  }]
+  # a device's steps are sent in order
+  assert [pct for did, pct in aio.sent if did == 'a'] == [70, 30]
+
+
+def test_devices_past_the_deadline_fail(monkeypatch):
+  monkeypatch.setattr(googlehome, '_EXECUTE_TIMEOUT', 0.2)
+  aio = RecordingApi(hanging=('b',))
+  start = time.monotonic()
+  results = _execute(aio, [(['a', 'b'], 40)])
+  assert time.monotonic() - start < 2
+  statuses = [(r['ids'], r['status']) for r in results]
+  assert statuses == [(['a#100001'], 'SUCCESS'), (['b#100001'], 'ERROR')]
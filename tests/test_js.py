@@ -0,0 +1,27 @@
+import json
+
+from src.js import JSON
+
+_RAW = bytes(range(256))
+
+
+def test_dumps_bytes():
+  assert JSON.dumps({'raw': _RAW}) == json.dumps({'raw': list(_RAW)})
+  assert JSON.dumps([bytearray(b'\x01\xff')]) == '[[1, 255]]'
+
+
+def test_dumps_raw_matches_dumps():
+  assert JSON.dumps_raw(_RAW) == JSON.dumps({'raw': _RAW})
+  assert JSON.dumps_raw(b'') == JSON.dumps({'raw': b''})
+
+
+def test_dumps_c2s_raw_matches_dumps():
+  for did in ('abc123', 'dïd"\\'):
+    expected = JSON.dumps({'cmd': 'c2s_raw', 'data': {'did': did, 'raw': _RAW}})
+    assert JSON.dumps_c2s_raw(did, _RAW) == expected
+
+
+def test_loads():
+  msg = JSON.dumps_c2s_raw('abc', _RAW)
+  assert JSON.loads(msg) == json.loads(msg)
+  assert JSON.loads(msg.encode('utf-8'))['data']['raw'] == list(_RAW)
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+from src.runtime import Runtime
+
+
+@pytest.fixture
+def runtime():
+  rt = Runtime('test-runtime')
+  yield rt
+  rt.stop()
+
+
+async def _thread_name(delay=0):
+  await asyncio.sleep(delay)
+  return threading.current_thread().name
+
+
+def test_run_from_many_threads(runtime):
+  results = []
+
+  def _run():
+    results.append(runtime.run(_thread_name(0.01), timeout=5))
+
+  threads = [threading.Thread(target=_run) for _ in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert results == ['test-runtime'] * 8
+
+
+def test_run_timeout_cancels(runtime):
+  cancelled = threading.Event()
+
+  async def _slow():
+    try:
+      await asyncio.sleep(10)
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+  with pytest.raises(asyncio.TimeoutError):
+    runtime.run(_slow(), timeout=0.05)
+  assert cancelled.wait(5)
+
+
+def test_run_async(runtime):
+
+  async def _outer():
+    return await runtime.run_async(_thread_name(), timeout=5)
+
+  loop = asyncio.new_event_loop()
+  try:
+    assert loop.run_until_complete(_outer()) == 'test-runtime'
+  finally:
+    loop.close()
+  assert runtime.run(_outer(), timeout=5) == 'test-runtime'
+
+
+def test_run_from_loop_thread_raises(runtime):
+
+  async def _nested():
+    runtime.run(_thread_name())
+
+  with pytest.raises(RuntimeError):
+    runtime.run(_nested(), timeout=5)
@@ -0,0 +1,49 @@
+from src.frame_constants import DataKeys
+from src.frames import (DEFAULT_DECODER, DEFAULT_ENCODER, CommandFrame,
+                        FrameData, FrameType, Header)
+from src.state import StateCache
+
+_CHANNEL = b'\x10\x02\x01'
+
+
+def _push(frame_type, *data):
+  frame = CommandFrame(Header(0, 145, 6), frame_type, data=list(data))
+  return DEFAULT_DECODER.decode_lazy(DEFAULT_ENCODER.encode(frame))
+
+
+def test_update_from_status_and_para():
+  states = StateCache()
+  dev_id = states.update(
+      'did',
+      _push(FrameType.DEVICE_STATUS_RESP,
+            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, _CHANNEL),
+            FrameData(DataKeys.DEVICE_CMD_DATA.value, b'\x01\x4b\x00')))
+  assert dev_id == 'did#100201'
+  assert states.get(dev_id).closed_pct == 75
+  assert states.get(dev_id).online
+
+  states.update(
+      'did',
+      _push(FrameType.DEVICE_PARA_RESP,
+            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, _CHANNEL),
+            FrameData(DataKeys.INNER_PARA_DATA.value, b'\x14')))
+  assert states.get(dev_id).closed_pct == 20
+
+
+def test_update_keeps_position_when_offline():
+  states = StateCache()
+  states.put('did#100201', 40)
+  states.update(
+      'did',
+      _push(FrameType.DEVICE_STATUS_RESP,
+            FrameData(DataKeys.DEVICE_ADDR_CHANNEL.value, _CHANNEL),
+            FrameData(DataKeys.ERROR.value, 1)))
+  state = states.get('did#100201')
+  assert state.closed_pct == 40 and not state.online
+
+
+def test_update_ignores_other_frames():
+  states = StateCache()
+  assert states.update('did', _push(FrameType.DEVICE_LIST_RESP)) is None
+  assert states.update('did', _push(FrameType.DEVICE_STATUS_RESP)) is None
+  assert len(states) == 0
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from conftest import TOKEN, run
+from fake_gizwits import status_resp
+from src.connection import ConnectionPool
+from src.state import StateCache
+from src.subscriber import StateSubscriber
+
+_CHANNEL = b'\x10\x02\x01'
+
+
+def test_watched_socket_feeds_the_cache_and_stays_alive(server):
+  states = StateCache()
+
+  async def _watch():
+    pool = ConnectionPool(
+        url='wss://gizwits.invalid', appid='app', heartbeat_interval=0.4)
+    subscriber = StateSubscriber(states, pool, idle_timeout=1.2)
+    try:
+      subscriber._watch(TOKEN)
+      await asyncio.sleep(0.05)
+      server.sockets[0].push(status_resp('did', _CHANNEL, 30))
+      await asyncio.sleep(1)
+      watching = subscriber.watching(TOKEN)
+
+      async def _noop(conn):
+        pass
+
+      # the watched socket is still good for requests
+      await pool.run(TOKEN, _noop)
+      await asyncio.sleep(0.4)
+      return watching, subscriber.watching(TOKEN)
+    finally:
+      await pool.close()
+
+  # watched until idle for idle_timeout
+  assert run(_watch()) == (True, False)
+  assert states.get('did#100201').closed_pct == 30
+  assert len(server.sockets) == 1
+  assert server.sockets[0].cmds().count('ping') >= 3
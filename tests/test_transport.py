@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('websockets')
+
+from conftest import TOKEN, run
+from fake_gizwits import status_resp
+from src import commands, connection
+from src.connection import ConnectionPool
+from src.frame_constants import DataKeys
+from src.gizapi import AsyncGizApi
+from src.transport import WebSocketTransport
+
+_CHANNEL = b'\x10\x00\x01'
+
+
+class HttpApi(AsyncGizApi):
+  """Records the commands sent over http instead of sending them."""
+
+  def __init__(self):
+    super(HttpApi, self).__init__(root='http://gizwits.invalid/')
+    self.http = []
+
+  async def check_token(self, giz_token):
+    return giz_token
+
+  async def control_http(self, giz_token, did, frame):
+    self.http.append(did)
+    return {}
+
+
+def _control(api, did='did', **kwargs):
+  """Sends one command through a fresh transport; returns it and the reply."""
+
+  async def _send():
+    pool = ConnectionPool(url='wss://gizwits.invalid', appid='app')
+    transport = WebSocketTransport(api, pool, **kwargs)
+    try:
+      return transport, await transport.control(
+          TOKEN, did, commands.set_closed_pct(_CHANNEL, 30))
+    finally:
+      await pool.close()
+
+  return run(_send())
+
+
+def test_falls_back_to_http_without_a_socket(server, monkeypatch):
+
+  async def _refuse(url, **kwargs):
+    raise OSError('connection refused')
+
+  monkeypatch.setattr(connection.websockets, 'connect', _refuse)
+  api = HttpApi()
+  transport, resp = _control(api)
+  assert resp == {}
+  assert api.http == ['did']
+  assert transport.fallbacks == 1
+
+
+def test_ack_is_matched_by_did_and_channel(server):
+
+  def _respond(did, frame):
+    channel = frame.get(DataKeys.DEVICE_ADDR_CHANNEL)
+    return [
+        status_resp('other', channel, 30),
+        status_resp(did, b'\x10\x01\x01', 30),
+        status_resp(did, channel, 30)
+    ]
+
+  server.respond = _respond
+  transport, resp = _control(HttpApi(), ack_timeout=5)
+  assert resp == {}
+  assert transport.confirmed.count == 1
+
+
+def test_missing_ack_is_an_error(server):
+  server.respond = lambda did, frame: [status_resp('other', _CHANNEL, 30)]
+  transport, resp = _control(HttpApi(), ack_timeout=0.1)
+  assert 'error_message' in resp
+  assert transport.unconfirmed == 1
+
+
+def test_error_push_is_an_error(server):
+  server.respond = lambda did, frame: [{
+      'cmd': 's2c_invalid_msg',
+      'data': {
+          'error_code': 1009,
+          'msg': 'device offline'
+      }
+  }]
+  transport, resp = _control(HttpApi(), ack_timeout=5)
+  assert resp == {'error_message': 'device offline', 'error_code': 1009}
+  assert transport.rejected == 1
+
+
+def test_frame_is_not_sent_again_after_the_socket_is_lost(server):
+
+  def _drop(did, frame):
+    asyncio.get_event_loop().call_soon(server.sockets[-1].drop)
+    return []
+
+  server.respond = _drop
+  api = HttpApi()
+  transport, resp = _control(api, ack_timeout=5)
+  assert 'error_message' in resp
+  assert [ws.cmds().count('c2s_raw') for ws in server.sockets] == [1]
+  assert api.http == []